@@ -14,6 +14,8 @@ CREATE TABLE vehicle (
 	PRIMARY KEY (vehicle_id)
 );
 
+-- vehicle_status is partitioned by month of ts; tesla-parser.py creates
+-- the partitions (vehicle_status_yYYYYmMM) as it needs them
 CREATE TABLE vehicle_status (
 	ts TIMESTAMP NOT NULL,
 	vehicle_id BIGINT REFERENCES vehicle(vehicle_id),
@@ -42,5 +44,63 @@ CREATE TABLE vehicle_status (
 	climate_on BOOLEAN DEFAULT NULL,
 	battery_heater BOOLEAN DEFAULT NULL,
 	valet_mode BOOLEAN DEFAULT NULL,
-	PRIMARY KEY (ts,vehicle_id)
-);
\ No newline at end of file
+	PRIMARY KEY (vehicle_id,ts)
+) PARTITION BY RANGE (ts);
+
+-- A small BRIN index for scans of all vehicles by time
+CREATE INDEX vehicle_status_ts_brin ON vehicle_status USING BRIN (ts);
+
+CREATE TABLE ingest_checkpoint (
+	path TEXT NOT NULL,
+	inode BIGINT NOT NULL,
+	byte_offset BIGINT NOT NULL,
+	restart_offset BIGINT NOT NULL,
+	last_time BIGINT DEFAULT NULL,
+	updated TIMESTAMP NOT NULL DEFAULT now(),
+	PRIMARY KEY (path)
+);
+
+CREATE TABLE drive_session (
+	vehicle_id BIGINT REFERENCES vehicle(vehicle_id),
+	start_ts TIMESTAMP NOT NULL,
+	end_ts TIMESTAMP NOT NULL,
+	distance REAL DEFAULT NULL,
+	battery_level SMALLINT DEFAULT NULL,
+	level_used SMALLINT DEFAULT NULL,
+	range_used REAL DEFAULT NULL,
+	efficiency REAL DEFAULT NULL,
+	PRIMARY KEY (vehicle_id,start_ts)
+);
+
+CREATE TABLE charge_session (
+	vehicle_id BIGINT REFERENCES vehicle(vehicle_id),
+	start_ts TIMESTAMP NOT NULL,
+	end_ts TIMESTAMP NOT NULL,
+	battery_level SMALLINT DEFAULT NULL,
+	level_added SMALLINT DEFAULT NULL,
+	range_added REAL DEFAULT NULL,
+	energy_added REAL DEFAULT NULL,
+	rate REAL DEFAULT NULL,
+	capacity REAL DEFAULT NULL,
+	max_range REAL DEFAULT NULL,
+	PRIMARY KEY (vehicle_id,start_ts)
+);
+
+CREATE TABLE idle_session (
+	vehicle_id BIGINT REFERENCES vehicle(vehicle_id),
+	start_ts TIMESTAMP NOT NULL,
+	end_ts TIMESTAMP NOT NULL,
+	mode VARCHAR(16) NOT NULL,
+	battery_level SMALLINT DEFAULT NULL,
+	level_used SMALLINT DEFAULT NULL,
+	range_used REAL DEFAULT NULL,
+	rate REAL DEFAULT NULL,
+	PRIMARY KEY (vehicle_id,start_ts)
+);
+
+CREATE TABLE session_state (
+	vehicle_id BIGINT REFERENCES vehicle(vehicle_id),
+	last_time BIGINT NOT NULL,
+	state JSONB NOT NULL,
+	PRIMARY KEY (vehicle_id)
+);
@@ -0,0 +1,40 @@
+-- Move a vehicle_status table made by an older create_tables.sql (not
+-- partitioned, keyed on (ts, vehicle_id)) to the partitioned layout,
+-- keeping its rows.  Needs PostgreSQL 11 or later.  Stop tesla-parser.py
+-- first and run once as the owner of the tables:
+--
+--   psql -U teslauser -f migrate_vehicle_status.sql tesladata
+--
+-- Everything happens in one transaction; vehicle_status is locked while
+-- its rows are copied.
+
+BEGIN;
+
+ALTER TABLE vehicle_status RENAME TO vehicle_status_unpartitioned;
+ALTER INDEX vehicle_status_pkey RENAME TO vehicle_status_unpartitioned_pkey;
+ALTER TABLE vehicle_status_unpartitioned RENAME CONSTRAINT vehicle_status_vehicle_id_fkey TO vehicle_status_unpartitioned_vehicle_id_fkey;
+
+CREATE TABLE vehicle_status (
+	LIKE vehicle_status_unpartitioned INCLUDING DEFAULTS,
+	FOREIGN KEY (vehicle_id) REFERENCES vehicle(vehicle_id),
+	PRIMARY KEY (vehicle_id,ts)
+) PARTITION BY RANGE (ts);
+
+CREATE INDEX vehicle_status_ts_brin ON vehicle_status USING BRIN (ts);
+
+-- One partition for each month with data, named as tesla-parser.py names them
+DO $$
+DECLARE
+	month DATE;
+BEGIN
+	FOR month IN SELECT DISTINCT date_trunc('month', ts)::date FROM vehicle_status_unpartitioned LOOP
+		EXECUTE format('CREATE TABLE %I PARTITION OF vehicle_status FOR VALUES FROM (%L) TO (%L)',
+			       to_char(month, '"vehicle_status_y"YYYY"m"MM'), month, (month + interval '1 month')::date);
+	END LOOP;
+END
+$$;
+
+INSERT INTO vehicle_status SELECT * FROM vehicle_status_unpartitioned;
+DROP TABLE vehicle_status_unpartitioned;
+
+COMMIT;
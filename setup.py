@@ -20,8 +20,8 @@ setup(name='teslajson',
       version=get_version(),
       description='Manipulate tesla API, send commands, poll data',
       url='https://github.com/SethRobertson/teslajson',
-      py_modules=['teslajson','tesla_parselib'],
-      scripts=['tesla_poller','tesla-parser.py','poller_rpc.py'],
+      py_modules=['teslajson','teslajson_async','tesla_parselib','tesla_mockserver','tesla_loggen'],
+      scripts=['tesla_poller','tesla-parser.py','poller_rpc.py','tesla_mockserver.py','tesla_bench.py','tesla_loggen.py'],
       author='Greg Glockner, Seth Robertson, Pedro Mendes',
       license='MIT',
       )
@@ -5,11 +5,21 @@
 
 import argparse
 import datetime
+import os
 import subprocess
 import tesla_parselib
 import json
+import time
+import heapq
+import tempfile
+import multiprocessing
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import psycopg2
 from psycopg2.extensions import AsIs
+from psycopg2.extras import execute_values, Json
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--verbose', '-v', action='count', help='Increasing levels of verbosity')
@@ -18,9 +28,47 @@ parser.add_argument('--follow', '-f', type=str, help='Follow this specific file'
 parser.add_argument('--numlines', '-n', type=str, help='Handle these number of lines')
 parser.add_argument('--outdir', default=None, help='Convert input files into daily output files')
 parser.add_argument('--dbconfig', type=str, help='Insert records in database using this config file')
+parser.add_argument('--batch', type=int, default=1000, help='Insert this many vehicle_status rows per database transaction')
+parser.add_argument('--batch_interval', type=float, default=5, help='Insert buffered vehicle_status rows at least this often (seconds)')
+parser.add_argument('--jobs', '-j', type=int, default=1, help='Parse input files in this many processes')
+parser.add_argument('--detach_before', type=str, help='With --dbconfig, detach the vehicle_status partitions of months before this one (YYYY-MM)')
+parser.add_argument('--checkpoint', type=str, help='With --dbconfig, resume each file where the last run stopped, keeping checkpoints in this json file (or "db" for the ingest_checkpoint table)')
+parser.add_argument('--since', type=str, help='Only records from this time on (YYYY-MM-DD[ HH:MM[:SS]] local time, or unix time)')
+parser.add_argument('--until', type=str, help='Only records up to this time (same formats as --since)')
+parser.add_argument('--vehicle', type=int, action='append', help='Only records of this vehicle_id (may be repeated)')
+parser.add_argument('--build_index', action='store_true', help='Just write or bring up to date the time index (FILE.tidx) of each (plain json) file')
+parser.add_argument('--json', default=tesla_parselib.json_backend, choices=sorted(tesla_parselib.JSON_DECODERS), help='json decoder to use')
 parser.add_argument('files', nargs='*')
 args = parser.parse_args()
 
+
+def parse_time(value):
+    """Unix time for a --since/--until argument"""
+    if value is None or value.isdigit():
+        return value and int(value)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(time.strptime(value, fmt)))
+        except ValueError:
+            pass
+    parser.error("cannot understand time %s"%value)
+
+args.since = parse_time(args.since)
+args.until = parse_time(args.until)
+
+if args.checkpoint and not args.dbconfig:
+    parser.error("--checkpoint needs --dbconfig")
+if args.checkpoint and (args.since is not None or args.until is not None or args.vehicle):
+    parser.error("--checkpoint cannot be used with --since, --until or --vehicle")
+
+tesla_parselib.set_json_backend(args.json)
+
+if args.build_index:
+    for fname in args.files:
+        if not fname.endswith(".jsonz"):
+            tesla_parselib.update_index(fname, save=True)
+    exit()
+
 if not args.numlines:
     args.numlines = "10"
 
@@ -70,24 +118,454 @@ if args.dbconfig:
 
 
 class openfile(object):
-    """Open a file"""
-    def __init__(self, filename, args):
+    """Open a file, or follow args.follow if filename is None
+
+    With checkpoints (a checkpoint_store), reading resumes where the
+    last ingest of the file stopped.  When following, idle is called
+    whenever there is nothing new to read.
+    """
+    def __init__(self, filename, args, checkpoints=None, idle=None):
         self.filename = filename
+        self.decoder = tesla_parselib.delta_decoder()
+        self.checkpoint_path = None
+        self.position = 0
+        self.skip_to = 0
+        self.time = None
         if filename:
-            self.fd = open(filename, "r")
-            self.sub = None
+            start = 0
+            if checkpoints is not None:
+                self.checkpoint_path = os.path.realpath(filename)
+                st = os.stat(self.checkpoint_path)
+                self.inode = st.st_ino
+                saved = checkpoints.get(self.checkpoint_path)
+                # a different inode or a shorter file means it was replaced, start over
+                if saved and saved["inode"] == st.st_ino and saved["offset"] <= st.st_size:
+                    start = self.position = saved["restart"]
+                    self.skip_to = saved["offset"]
+                    self.time = saved["time"]
+            self.fd = tesla_parselib.open_log(filename, vehicles=args.vehicle, since=args.since, until=args.until, start=start)
         else:
-            self.sub = subprocess.Popen(['tail','-n', args.numlines, '-F', args.follow], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.fd = self.sub.stdout
+            self.fd = tesla_parselib.tail_follower(args.follow, numlines=int(args.numlines), idle=idle)
+
+    def records(self):
+        """Yield (line, record) for the records we want, skipping those already ingested"""
+        while True:
+            self.decoder.position = self.position
+            line = self.fd.readline()
+            if not line:
+                return
+            if self.checkpoint_path is not None and not line.endswith("\n"):
+                # still being written, leave it for the next run
+                return
+            self.position = getattr(self.fd, "position", self.position + len(line))
+
+            # parse the json into 'this' object
+            this = tesla_parselib.tesla_record(line, want_offline=args.verbose>2, decoder=self.decoder)
+
+            # if no valid object move on to the next
+            if not this or not wanted(this):
+                continue
+
+            # ingested by an earlier run (a .jsonz position only says which block to read again)
+            if self.position < self.skip_to or (self.position == self.skip_to and not hasattr(self.fd, "position")):
+                continue
+
+            self.time = this.time
+            if args.outdir:
+                line = full_line(line, this, self.decoder)
+            yield line, this
+
+    def checkpoint(self):
+        """(path, checkpoint) for what has been read so far, or None without checkpoints"""
+        if self.checkpoint_path is None:
+            return None
+        return (self.checkpoint_path, {"inode": self.inode, "offset": self.position,
+                                       "restart": self.decoder.restart_position(self.position), "time": self.time})
 
     def __enter__(self):
-        return self.fd
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.filename:
-            self.fd.close()
+        self.fd.close()
+
+
+class checkpoint_store(object):
+    """How far ingest got in each input file, kept in a json file or (with "db") the ingest_checkpoint table
+
+    Maps the real path of each file to {"inode", "offset" (bytes
+    ingested), "restart" (where to start reading to rebuild the records
+    after offset, earlier for delta logs), "time" (of the last record)}.
+    """
+
+    def __init__(self, where, dbconn):
+        self.where = where
+        self.dbconn = dbconn
+        if where == "db":
+            try:
+                cursor = dbconn.cursor()
+                cursor.execute('SELECT path, inode, byte_offset, restart_offset, last_time FROM ingest_checkpoint;')
+                self.saved = dict([(row[0], {"inode": row[1], "offset": row[2], "restart": row[3], "time": row[4]})
+                                   for row in cursor.fetchall()])
+                cursor.close()
+            except (Exception, psycopg2.Error) as error :
+                print(error)
+                print("Failed to query ingest_checkpoint table, cannot continue")
+                exit()
+        else:
+            try:
+                with open(where, "r") as R:
+                    self.saved = json.load(R)
+            except IOError:
+                self.saved = {}
+
+
+    def get(self, path):
+        return self.saved.get(path)
+
+
+    def save(self, checkpoints):
+        """Record a dictionary of path: checkpoint"""
+
+        self.saved.update(checkpoints)
+        if self.where != "db":
+            tmpname = "%s.%d"%(self.where, os.getpid())
+            with open(tmpname, "w") as W:
+                json.dump(self.saved, W)
+            os.rename(tmpname, self.where)
+            return
+
+        values = [(path, c["inode"], c["offset"], c["restart"], c["time"]) for path, c in checkpoints.items()]
+        cursor = self.dbconn.cursor()
+        try:
+            execute_values(cursor, "INSERT INTO ingest_checkpoint (path, inode, byte_offset, restart_offset, last_time) VALUES %s "
+                           "ON CONFLICT (path) DO UPDATE SET inode = EXCLUDED.inode, byte_offset = EXCLUDED.byte_offset, "
+                           "restart_offset = EXCLUDED.restart_offset, last_time = EXCLUDED.last_time, updated = now()", values)
+        except (Exception, psycopg2.Error) as error :
+            print(error)
+            print("Failed to save ingest checkpoint")
+            self.dbconn.rollback()
         else:
-            self.sub.kill()
+            self.dbconn.commit()
+        cursor.close()
+
+
+class db_ingest(object):
+    """Insert records into the vehicle and vehicle_status tables
+
+    vehicle_status rows are buffered and written with one multi-row
+    INSERT and one commit per batch.  With --checkpoint, the input
+    positions given to mark() are saved once each batch is committed.
+
+    When vehicle_status is partitioned by month, missing partitions are
+    created before each batch is inserted.
+
+    Records are also fed to a session_segmenter, whose sessions go to
+    the drive_session, charge_session and idle_session tables with each
+    batch.  Its state is kept in the session_state table so the next run
+    carries on; records not newer than that state are not fed again.
+    """
+
+    def __init__(self, dbconn, args):
+        self.dbconn = dbconn
+        self.verbose = args.verbose
+        self.batch = max(1, args.batch)
+        self.batch_interval = args.batch_interval
+        self.rows = []
+        self.first_buffered = 0
+        self.marks = {}
+        self.checkpoints = checkpoint_store(args.checkpoint, dbconn) if args.checkpoint else None
+        self.segmenter = tesla_parselib.session_segmenter()
+        self.sessions = []
+        self.states = set()
+        self.load_vehicles()
+        self.load_partitions()
+        self.load_session_state()
+
+
+    def add(self, this):
+        """Queue a record for insertion, flushing the batch if it is full (or old)"""
+
+        if not self.vehicle(this):
+            return
+
+        last = self.segmenter.last_time(this.vehicle_id)
+        if last is None or this.time > last:
+            session = self.segmenter.feed(this)
+            self.states.add(this.vehicle_id)
+            if session:
+                self.sessions.append(session.sql_session_insert_dict())
+
+        if not self.rows and not self.marks:
+            self.first_buffered = time.time()
+        self.rows.append(this.sql_vehicle_status_insert_dict())
+
+        if len(self.rows) >= self.batch:
+            self.flush()
+        else:
+            self.flush_due()
+
+
+    def flush_due(self):
+        """Flush if rows or marks have been buffered for batch_interval (also called while the input is idle)"""
+
+        if (self.rows or self.marks) and time.time() - self.first_buffered >= self.batch_interval:
+            self.flush()
+
+
+    def load_vehicles(self):
+        """Cache the vehicle table, as a dictionary of column values per vehicle_id"""
+
+        try:
+            cursor = self.dbconn.cursor()
+            cursor.execute('SELECT * FROM vehicle;')
+            columns = [desc[0] for desc in cursor.description]
+            self.vehicle_columns = columns
+            self.vehicles = dict([(row[0], dict(zip(columns, row))) for row in cursor.fetchall()])
+            cursor.close()
+        except (Exception, psycopg2.Error) as error :
+            print(error)
+            print("Failed to query vehicle table, cannot continue")
+            exit()
+
+
+    def load_partitions(self):
+        """Find out whether vehicle_status is partitioned, and which month partitions it has"""
+
+        try:
+            cursor = self.dbconn.cursor()
+            cursor.execute("SELECT count(*) FROM pg_partitioned_table WHERE partrelid = 'vehicle_status'::regclass;")
+            self.partitioned = cursor.fetchone()[0] > 0
+            cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                           "WHERE i.inhparent = 'vehicle_status'::regclass;")
+            self.partitions = set([row[0] for row in cursor.fetchall()])
+            cursor.close()
+        except (Exception, psycopg2.Error) as error :
+            print(error)
+            print("Failed to query vehicle_status partitions, cannot continue")
+            exit()
+
+
+    def partition(self, month):
+        """Create the vehicle_status partition for month (YYYY-MM) unless it exists"""
+
+        year, mon = [int(x) for x in month.split("-")]
+        name = "vehicle_status_y%04dm%02d"%(year, mon)
+        if name in self.partitions:
+            return
+        upper = "%04d-%02d-01"%(year + mon // 12, mon % 12 + 1)
+        cursor = self.dbconn.cursor()
+        try:
+            cursor.execute("CREATE TABLE %s PARTITION OF vehicle_status FOR VALUES FROM ('%s-01') TO ('%s')"%(name, month, upper))
+        except (Exception, psycopg2.Error) as error :
+            print(error)
+            print("Failed to create partition %s"%name)
+            self.dbconn.rollback()
+        else:
+            self.dbconn.commit()
+            self.partitions.add(name)
+            if self.verbose>0:
+                print("Created partition %s"%name)
+        cursor.close()
+
+
+    def detach(self, before):
+        """Detach the vehicle_status partitions of months before before (YYYY-MM), leaving them as plain tables"""
+
+        year, mon = [int(x) for x in before.split("-")]
+        limit = "vehicle_status_y%04dm%02d"%(year, mon)
+        cursor = self.dbconn.cursor()
+        for name in sorted(self.partitions):
+            if not name.startswith("vehicle_status_y") or len(name) != len(limit) or name >= limit:
+                continue
+            try:
+                cursor.execute("ALTER TABLE vehicle_status DETACH PARTITION %s"%name)
+            except (Exception, psycopg2.Error) as error :
+                print(error)
+                print("Failed to detach partition %s"%name)
+                self.dbconn.rollback()
+            else:
+                self.dbconn.commit()
+                self.partitions.discard(name)
+                print("Detached partition %s"%name)
+        cursor.close()
+
+
+    def load_session_state(self):
+        """Restore the session_segmenter state saved by earlier runs"""
+
+        try:
+            cursor = self.dbconn.cursor()
+            cursor.execute('SELECT vehicle_id, state FROM session_state;')
+            for vehicle_id, state in cursor.fetchall():
+                self.segmenter.set_state(vehicle_id, state)
+            cursor.close()
+        except (Exception, psycopg2.Error) as error :
+            print(error)
+            print("Failed to query session_state table, cannot continue")
+            exit()
+
+
+    def vehicle(self, this):
+        """Add this vehicle to the vehicle table or update it, returning False if that failed"""
+
+        current = self.vehicles.get(this.vehicle_id)
+        if current is None:
+            # this is the first time we've seen this car, add it
+            insert_str = "INSERT INTO vehicle (%s) VALUES %s"
+            insertargs = this.sql_vehicle_insert_dict()
+            columns = list(insertargs.keys())
+            values = [insertargs[column] for column in columns]
+            cursor = self.dbconn.cursor()
+            try:
+                cursor.execute(insert_str, (AsIs(','.join(columns)), tuple(values)))
+            except (Exception, psycopg2.Error) as error :
+                if self.verbose>0:
+                    print(error)
+                print("Failed to insert record into vehicle table, skipping status")
+                self.dbconn.rollback()
+                cursor.close()
+                return False
+            self.dbconn.commit()
+            cursor.close()
+            # Every column, as a row read back from the table would have them
+            current = dict([(column, None) for column in self.vehicle_columns])
+            current.update(insertargs)
+            self.vehicles[this.vehicle_id] = current
+            return True
+
+        # we've already got this car, check if anything changed and update
+        updateargs = this.sql_vehicle_update_dict(current)
+        if not updateargs:
+            return True
+
+        if (current["display_name"] != this.display_name) and (self.verbose>0):
+            print('This car\'s name has changed from \'{}\' to \'{}\'!'.format(current["display_name"], this.display_name))
+        if (this.car_version is not None) and (current["car_version"] != this.car_version) and (self.verbose>0):
+            print('This car was updated to version {}'.format(this.car_version))
+        # update the row
+        if( len(updateargs) == 1):
+            query_template = "UPDATE vehicle SET {} = %s WHERE vehicle_id = {}"
+        else:
+            query_template = "UPDATE vehicle SET ({}) = %s WHERE vehicle_id = {}"
+        query = query_template.format( ', '.join(updateargs.keys()), this.vehicle_id )
+        if( len(updateargs) == 1):
+            vals = (list(updateargs.values())[0],)
+        else:
+            vals = (tuple(updateargs.values()),)
+        cursor = self.dbconn.cursor()
+        try:
+            cursor.execute(query,vals)
+        except (Exception, psycopg2.Error) as error :
+            if self.verbose>0:
+                print(error)
+            print("Failed to update record in vehicle table")
+            self.dbconn.rollback()
+        else:
+            self.dbconn.commit()
+            current.update(updateargs)
+        cursor.close()
+        return True
+
+
+    def mark(self, path, checkpoint):
+        """Note that everything read from path up to checkpoint has been added"""
+        if not self.rows and not self.marks:
+            self.first_buffered = time.time()
+        self.marks[path] = checkpoint
+
+
+    def flush(self):
+        """Write all buffered vehicle_status rows, then the checkpoints of what they came from
+
+        The checkpoints are only saved once the rows and sessions have
+        been committed; otherwise they are kept for the next flush.
+        """
+
+        committed = True
+        if self.rows:
+            rows, self.rows = self.rows, []
+            if self.partitioned:
+                for month in set([str(row["ts"])[:7] for row in rows]):
+                    self.partition(month)
+            committed = self._insert(rows)
+
+        if self.sessions or self.states:
+            committed = self._insert_sessions() and committed
+
+        if self.marks and self.checkpoints and committed:
+            marks, self.marks = self.marks, {}
+            self.checkpoints.save(marks)
+        self.first_buffered = time.time()
+
+
+    def _insert_sessions(self):
+        """Insert the sessions found since the last flush and save the segmenter state, in one transaction
+
+        Returns whether the transaction was committed.
+        """
+
+        sessions, self.sessions = self.sessions, []
+        states, self.states = self.states, set()
+        cursor = self.dbconn.cursor()
+        try:
+            for table, columns in tesla_parselib.SESSION_COLUMNS.items():
+                columns = ("vehicle_id", "start_ts", "end_ts") + columns
+                values = [tuple([row.get(column) for column in columns]) for t, row in sessions if t == table]
+                if values:
+                    execute_values(cursor, "INSERT INTO %s (%s) VALUES %%s ON CONFLICT DO NOTHING"%(table, ','.join(columns)), values)
+
+            values = [(vehicle_id, self.segmenter.last_time(vehicle_id), Json(self.segmenter.get_state(vehicle_id)))
+                      for vehicle_id in states]
+            if values:
+                execute_values(cursor, "INSERT INTO session_state (vehicle_id, last_time, state) VALUES %s "
+                               "ON CONFLICT (vehicle_id) DO UPDATE SET last_time = EXCLUDED.last_time, state = EXCLUDED.state", values)
+        except (Exception, psycopg2.Error) as error :
+            print(error)
+            print("Failed to insert sessions")
+            self.dbconn.rollback()
+            cursor.close()
+            return False
+        self.dbconn.commit()
+        cursor.close()
+        return True
+
+
+    def _insert(self, rows):
+        """Insert vehicle_status rows in one statement, skipping (and maybe reporting) duplicates
+
+        Returns whether any of the rows could be committed: a row that
+        fails on its own is skipped, but if all fail the database is
+        probably unreachable.
+        """
+
+        values = [tuple([row.get(column) for column in tesla_parselib.VEHICLE_STATUS_COLUMNS]) for row in rows]
+        insert_str = "INSERT INTO vehicle_status (%s) VALUES %%s ON CONFLICT DO NOTHING RETURNING vehicle_id, ts"%','.join(tesla_parselib.VEHICLE_STATUS_COLUMNS)
+        cursor = self.dbconn.cursor()
+        try:
+            execute_values(cursor, insert_str, values, page_size=len(values))
+            inserted = set([(vehicle_id, str(ts)) for vehicle_id, ts in cursor.fetchall()])
+        except (Exception, psycopg2.Error) as error :
+            self.dbconn.rollback()
+            cursor.close()
+            if len(rows) > 1:
+                # find the bad row(s) and insert the others
+                return any([self._insert([row]) for row in rows])
+            if self.verbose>0:
+                print("Error: failed to insert record into vehicle_status")
+                print(error)
+            return False
+        self.dbconn.commit()
+        cursor.close()
+
+        # if the user wants verbosity we will expose duplicate keys
+        # if no verbosity is requested we silently skip inserts with duplicate key
+        if self.verbose>0 and len(inserted) < len(rows):
+            for row in rows:
+                if (row['vehicle_id'], str(row['ts'])) not in inserted:
+                    print('Did not insert record into vehicle_status: duplicate timestamp')
+                    if self.verbose>1:
+                        print('vehicle: {} timestamp: {}'.format(row['vehicle_id'],row['ts']))
+        return True
 
 
 nexthour = 0
@@ -134,230 +612,165 @@ def outputit(this):
            add))
 
 
-firstthismode = None
-lastprevmode = None
-save = None
-lastthis = None
-reallasttime = None
+def print_session(s):
+    """Print the summary line of a session from tesla_parselib.session_segmenter"""
+
+    start = datetime.datetime.fromtimestamp(s.start).strftime('%Y-%m-%d %H:%M:%S')
+    duration = str(datetime.timedelta(seconds=s.duration))
+    if not s.complete:
+        print("%s            ending %s, but did not have previous state to compute deltas"%(start, s.mode))
+    elif s.mode == "Charging":
+        print("%s +%-16s Charged   %3d%% (to %3d%%) %5.2fkW %5.1fM (%3dmph, %4.1fkW %5.1fM max)"%
+              (start, duration, s.level_delta, s.battery_level, s.energy_added, s.range_delta,
+               s.rate or 0, s.capacity, s.max_range or 0))
+    elif s.mode == "Driving":
+        if s.distance > -1:
+            print("%s +%-16s Drove  %6.2fM at cost of %2.0f%% %5.1fM at %5.1f%% efficiency"%
+                  (start, duration, s.distance, s.level_delta, s.range_delta, s.efficiency))
+    elif s.mode == "Standby":
+        print("%s +%-16s Sat&Lost %2.0f%% %5.1fM or %5.1fM/d (to %3d%%)"%
+              (start, duration, s.level_delta, s.range_delta, s.rate or 0, s.battery_level))
+    elif s.mode == "Conditioning":
+        print("%s +%-16s Conditioned %2.0f%% %5.1fM or %5.1fM/d (to %3d%%)"%
+              (start, duration, s.level_delta, s.range_delta, s.rate or 0, s.battery_level))
+    else:
+        print("Do not handle mode %s"%s.mode)
 
-# loop over all files
-for fname in args.files:
-    with openfile(fname, args) as R:
-        linenum=0
-        # loop over all json records (one per line)
-        while True:
-	    # read a line
-            line = R.readline()
-            linenum += 1
-            if not line:
-                break
-	    # parse the json into 'this' object
-            this = tesla_parselib.tesla_record(line, want_offline=args.verbose>2)
 
-            # if no valid object move on to the next
-            if not this:
-                continue
+segmenter = tesla_parselib.session_segmenter()
 
-            # if we are using the database fill it up!
-            if args.dbconfig:
-	        # check if this vehicle_id is already in the vehicle table
-	        try:
-		    cursor = dbconn.cursor()
-		    query = 'SELECT * FROM vehicle WHERE vehicle_id={};'.format(this.vehicle_id)
-		    cursor.execute(query)
-		except (Exception, psycopg2.Error) as error :
-		    if(dbconn):
-			print error
-			print "Failed to query vehicle table, cannot continue"
-			exit()
-		if cursor.rowcount<1:
-		    # this is the first time we've seen this car, add it
-		    insert_str = "INSERT INTO vehicle (%s) VALUES %s"
-		    insertargs = this.sql_vehicle_insert_dict()
-		    columns = insertargs.keys()
-		    values = [insertargs[column] for column in columns]
-		    #print cursor.mogrify(insert_str, (AsIs(','.join(columns)), tuple(values)))
-		    try:
-		        cursor.execute(insert_str, (AsIs(','.join(columns)), tuple(values)))
-		    except (Exception, psycopg2.Error) as error :
-			if args.verbose>0:
-			    print error
-			print "Failed to insert record into vehicle table, skipping status"
-			dbconn.rollback()
-			cursor.close()
-			continue
-		    else:
-		        dbconn.commit()		      
-	        else:
-		    # we've already got this car, check if anything changed and update
-		    res = cursor.fetchone()
-		    if (res[2] != this.display_name) and (args.verbose>0):
-		        print 'This car\'s name has changed from \'{}\' to \'{}\'!'.format(res[2], this.display_name)
-	            if (this.car_version is not None) and (res[11] != this.car_version) and (args.verbose>0):
-		        print 'This car was updated to version {}'.format(this.car_version)
-		    # check if we need to update anything and get the string for the update
-		    updateargs = this.sql_vehicle_update_dict(res)
-		    # update the row if needed
-		    if( len(updateargs) == 1):
-		        query_template = "UPDATE vehicle SET {} = %s WHERE vehicle_id = {}"
-		        keyval = updateargs.keys()
-		        query = query_template.format(keyval[0], this.vehicle_id )   
-		    if( len(updateargs) > 1 ):
-		        query_template = "UPDATE vehicle SET ({}) = %s WHERE vehicle_id = {}"
-		        query = query_template.format( ', '.join(updateargs.keys()), this.vehicle_id )
-		    if( len(updateargs) > 0 ):
-		        vals = (tuple(updateargs.values()),)
-		        try:
-		            cursor.execute(query,vals)
-		        except (Exception, psycopg2.Error) as error :
-			    if args.verbose>0:
-			        print error
-			    print "Failed to update record in vehicle table"
-			    dbconn.rollback()
-			else:
-		            dbconn.commit()
-		# close cursor and open a new one to clear any possible error
-	        try:
-		    cursor.close()
-		except (Exception, psycopg2.Error) as error :
-		    print error
-		    print "Trouble with the database connection, cannot continue"
-		    exit()
-		cursor = dbconn.cursor()
-		# add a new vehicle_status row
-		# if the user wants verbosity we will expose duplicate key errors
-		# if no verbosity is requested we silently skip inserts with duplicate key
-		if args.verbose>0 :
-		   insert_str = "INSERT INTO vehicle_status (%s) VALUES %s"
-		else:
-		   insert_str = "INSERT INTO vehicle_status (%s) VALUES %s ON CONFLICT DO NOTHING"
-		insertargs = this.sql_vehicle_status_insert_dict()
-		columns = insertargs.keys()
-		values = [insertargs[column] for column in columns]
-		try:
-		    cursor.execute(insert_str, (AsIs(','.join(columns)), tuple(values)))
-		except (Exception, psycopg2.Error) as error :
-		    if args.verbose>0:
-		        if error.diag.sqlstate == '23505' :
-		            print 'Did not insert record into vehicle_status: duplicate timestamp'
-		            if args.verbose>1:
-			       print 'vehicle: {} timestamp: {}'.format(insertargs['vehicle_id'],insertargs['ts'])
-		        else:
-		            print "Error: failed to insert record into vehicle_status"
-			    print error
-		    dbconn.rollback()
-		else:
-		    dbconn.commit()
-		# close this cursor, will open a new one in next iteration
-		cursor.close()
-		# as we are inserting data into the database we do nothing else with this record
-		continue
-
-            # output data to file in outdir
-            if args.outdir:
-                output_maintenance(this.time)
-                X.write(line)
+def process_record(line, this):
+    """Handle one record read from the input"""
 
-            if this.mode == "Polling":
-                reallasttime = this.time
-                if args.verbose > 1:
-                    outputit(this)
-                continue
+    # if we are using the database fill it up!
+    if args.dbconfig:
+        ingest.add(this)
+        # as we are inserting data into the database we do nothing else with this record
+        return
+
+    # output data to file in outdir
+    if args.outdir:
+        output_maintenance(this.time)
+        X.write(line)
+
+    # analyze data and provide a summary
+    session = None
+    if not args.nosummary:
+        session = segmenter.feed(this)
+        if segmenter.polled_time:
+            this.time = segmenter.polled_time
+
+    if this.mode == "Polling":
+        if args.verbose > 1:
+            outputit(this)
+        return
+
+    if session:
+        print_session(session)
+
+    if args.verbose:
+        outputit(this)
+
+
+def wanted(this):
+    """Whether the record matches --since, --until and --vehicle"""
+    if args.since is not None and this.time < args.since:
+        return False
+    if args.until is not None and this.time > args.until:
+        return False
+    if args.vehicle and this.vehicle_id not in args.vehicle:
+        return False
+    return True
+
+
+def full_line(line, this, decoder):
+    """The line to copy to outdir: delta lines are replaced by the rebuilt record"""
+    if decoder.rebuilt:
+        return json.dumps(this.jline)+"\n"
+    return line
 
-            if save:
-                save = save + this
-            else:
-                save = this
-                prev = this
-
-            # analyze data and provide a summary
-            while firstthismode and not args.nosummary:
-                if firstthismode.mode != this.mode:
-
-                    if reallasttime:
-                        this.time = reallasttime
-                        reallasttime = None
-
-                    firstthismodetime = datetime.datetime.fromtimestamp(firstthismode.time)
-                    thistime = datetime.datetime.fromtimestamp(save.time)
-                    if not lastprevmode or not lastprevmode.usable_battery_level or not lastprevmode.odometer:
-                        print("%s            ending %s, but did not have previous state to compute deltas"%
-                              (firstthismodetime.strftime('%Y-%m-%d %H:%M:%S'), firstthismode.mode))
-                    elif firstthismode.mode == "Charging":
-                        battery_range = save.battery_range if save.battery_range > lastthis.battery_range else lastthis.battery_range
-                        if this.usable_battery_level > save.usable_battery_level:
-                            usable_battery_level = this.usable_battery_level
-                        elif save.usable_battery_level > lastthis.usable_battery_level:
-                            usable_battery_level = save.usable_battery_level
-                        else:
-                            usable_battery_level = lastthis.usable_battery_level
-
-                        usable_battery_level = save.usable_battery_level if save.usable_battery_level > lastthis.usable_battery_level else lastthis.usable_battery_level
-                        dblevel = usable_battery_level - lastprevmode.usable_battery_level
-
-                        print("%s +%-16s Charged   %3d%% (to %3d%%) %5.2fkW %5.1fM (%3dmph, %4.1fkW %5.1fM max)"%
-                              (firstthismodetime.strftime('%Y-%m-%d %H:%M:%S'),
-                               str(thistime-firstthismodetime),
-                               dblevel,
-                               usable_battery_level,
-                               save.charge_energy_added,
-                               battery_range - lastprevmode.battery_range,
-                               ((battery_range - lastprevmode.battery_range)*3600.0 /
-                                (thistime-firstthismodetime).total_seconds()),
-                               (save.charge_energy_added * 100.0 /
-                                (dblevel)) if dblevel > 0 else -0,
-                               battery_range * 100.0 / save.usable_battery_level))
-                    elif firstthismode.mode == "Driving":
-                        if not this.odometer:
-                            break
-                        battery_range = save.battery_range if save.battery_range < lastthis.battery_range else lastthis.battery_range
-                        usable_battery_level = save.usable_battery_level if save.usable_battery_level < lastthis.usable_battery_level else lastthis.usable_battery_level
-                        dodo = save.odometer - lastprevmode.odometer
-                        drange = lastprevmode.battery_range - battery_range
-
-                        if dodo > -1:
-                            print("%s +%-16s Drove  %6.2fM at cost of %2.0f%% %5.1fM at %5.1f%% efficiency"%
-                                  (firstthismodetime.strftime('%Y-%m-%d %H:%M:%S'),
-                                   str(thistime-firstthismodetime),
-                                   dodo,
-                                   lastprevmode.usable_battery_level - usable_battery_level,
-                                   drange,
-                                   dodo * 100.0 / drange if drange > 0 else -0))
-                    elif firstthismode.mode == "Standby":
-                        battery_range = save.battery_range if save.battery_range < lastthis.battery_range else lastthis.battery_range
-                        usable_battery_level = lastthis.usable_battery_level
-                        drange = lastprevmode.battery_range - battery_range
-                        print("%s +%-16s Sat&Lost %2.0f%% %5.1fM or %5.1fM/d (to %3d%%)"%
-                              (firstthismodetime.strftime('%Y-%m-%d %H:%M:%S'),
-                               str(thistime-firstthismodetime),
-                               lastprevmode.usable_battery_level - usable_battery_level,
-                               drange,
-                               drange / (((thistime-firstthismodetime).total_seconds()) / 86400.0),
-                               usable_battery_level))
-                    elif firstthismode.mode == "Conditioning":
-                        battery_range = save.battery_range if save.battery_range < lastthis.battery_range else lastthis.battery_range
-                        usable_battery_level = lastthis.usable_battery_level
-                        drange = lastprevmode.battery_range - battery_range
-                        print("%s +%-16s Conditioned %2.0f%% %5.1fM or %5.1fM/d (to %3d%%)"%
-                              (firstthismodetime.strftime('%Y-%m-%d %H:%M:%S'),
-                               str(thistime-firstthismodetime),
-                               lastprevmode.usable_battery_level - usable_battery_level,
-                               drange,
-                               drange / (((thistime-firstthismodetime).total_seconds()) / 86400.0),
-                               usable_battery_level))
-
-
-                    else:
-                        print("Do not handle mode %s"%firstthismode.mode)
-                    firstthismode = save
-                    lastprevmode = lastthis
-                break
-            else:
-                reallasttime = None
-                firstthismode = save
-                lastprevmode = save
-            lastthis = save
 
-            if args.verbose:
-                outputit(this)
+def parse_file(fname):
+    """Parse a whole file (in a worker process) into a temporary file, returning its name
 
+    The temporary file holds pickled lists of up to 10000 (line, record,
+    checkpoint) for the records we want, the last ending with (None,
+    None, checkpoint) for the end of the file.
+    """
+    W = tempfile.NamedTemporaryFile(prefix="tesla-parser.", suffix=".records", delete=False)
+    try:
+        chunk = []
+        with openfile(fname, args, checkpoints) as R:
+            for line, this in R.records():
+                chunk.append((line if args.outdir else None, this.release(), R.checkpoint()))
+                if len(chunk) >= 10000:
+                    pickle.dump(chunk, W, pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            chunk.append((None, None, R.checkpoint()))
+        pickle.dump(chunk, W, pickle.HIGHEST_PROTOCOL)
+        W.close()
+    except:
+        W.close()
+        os.unlink(W.name)
+        raise
+    return W.name
+
+
+def parsed_records(index, result):
+    """Yield (time, index, n, line, record, checkpoint) from the file named by a parse_file result, removing it
+
+    The end of the file comes with the time of its last record.
+    """
+    fname = result.get()
+    n = 0
+    last = None
+    try:
+        with open(fname, "rb") as R:
+            while True:
+                try:
+                    chunk = pickle.load(R)
+                except EOFError:
+                    break
+                for line, this, checkpoint in chunk:
+                    if this:
+                        last = this.time
+                    yield (last, index, n, line, this, checkpoint)
+                    n += 1
+    finally:
+        os.unlink(fname)
+
+
+checkpoints = None
+if args.dbconfig:
+    ingest = db_ingest(dbconn, args)
+    checkpoints = ingest.checkpoints
+    if args.detach_before:
+        ingest.detach(args.detach_before)
+
+# parse complete files in parallel, then handle their records merged in time order
+files = args.files
+if args.jobs > 1:
+    files = [fname for fname in args.files if fname is None]
+    pool = multiprocessing.Pool(args.jobs)
+    results = [pool.apply_async(parse_file, (fname,)) for fname in args.files if fname is not None]
+    pool.close()
+    for when, index, n, line, this, checkpoint in heapq.merge(*[parsed_records(index, result) for index, result in enumerate(results)]):
+        if this:
+            process_record(line, this)
+        if checkpoint:
+            ingest.mark(*checkpoint)
+    pool.join()
+
+# loop over all files
+for fname in files:
+    with openfile(fname, args, checkpoints, idle=ingest.flush_due if args.dbconfig else None) as R:
+        # loop over all json records (one per line)
+        for line, this in R.records():
+            process_record(line, this)
+            if checkpoints:
+                ingest.mark(*R.checkpoint())
+        if checkpoints:
+            ingest.mark(*R.checkpoint())
+
+if args.dbconfig:
+    ingest.flush()
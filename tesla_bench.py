@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+""" Load test teslajson or tesla_poller against tesla_mockserver.py, or time the log parser
+
+Starts the mock server with N simulated vehicles, then for the given
+duration either polls them with teslajson from a number of threads
+(--target client) or runs tesla_poller on them (--target poller), and
+reports polls per second, latency percentiles, CPU time and peak RSS
+of the client or poller.  Client latencies are measured by the client;
+poller latencies are the server handling times of the poll requests.
+
+--target parser instead times each stage of parsing tesla_poller logs
+(--logs, or a log of N vehicles for --days made by tesla_loggen.py)
+the way tesla-parser.py does: reading, json decoding, field
+extraction, mode classification, merging (tesla_record +), session
+segmentation, building vehicle_status rows and copying lines out.
+It reports records per second for each stage and the peak RSS.
+
+Example:
+
+./tesla_bench.py --vehicles 50 --duration 30 --latency 0.05
+./tesla_bench.py --target poller --vehicles 50 --duration 60 --poller_args "--intervals Unknown=1 --intervals recent=2"
+./tesla_bench.py --target parser --vehicles 20 --days 30
+"""
+
+try: # Python 3
+    from urllib.request import urlopen
+except: # Python 2
+    from urllib2 import urlopen
+import argparse
+import itertools
+import json
+import os
+import resource
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import teslajson
+from tesla_mockserver import percentile
+
+
+
+def start_server(args):
+    """Start the mock server, returning (process, tesla_client)"""
+
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tesla_mockserver.py"),
+                               "--port", "0", "--vehicles", str(args.vehicles), "--cycle", str(args.cycle),
+                               "--latency", str(args.latency), "--error_rate", str(args.error_rate), "--seed", "1"],
+                              stdout=subprocess.PIPE)
+    return server, json.loads(server.stdout.readline().decode('utf-8'))
+
+
+
+def server_stats(client, reset=False):
+    """Get the statistics of the mock server"""
+    return json.loads(urlopen("%s/stats%s" % (client["v1"]["baseurl"], "?reset=1" if reset else "")).read().decode('utf-8'))
+
+
+
+def usage(who):
+    """CPU seconds and peak RSS (MB) of this process or of its waited for children"""
+    ru = resource.getrusage(who)
+    return ru.ru_utime + ru.ru_stime, ru.ru_maxrss / 1024.0
+
+
+
+def run_client(args, client):
+    """Poll every vehicle from args.threads threads for args.duration, returning (polls, latencies, errors)"""
+
+    c = teslajson.Connection(access_token="bench", tesla_client=client, validate_baseurl=False, retries=args.retries,
+                             retry_delay=0.1, pool_size=args.threads)
+    server_stats(client, reset=True)
+
+    latencies = []
+    counts = {"polls": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.time() + args.duration
+
+    def timed(call, *cargs):
+        start = time.time()
+        try:
+            return call(*cargs)
+        finally:
+            with lock:
+                latencies.append(time.time() - start)
+
+    def poll(vehicles):
+        while time.time() < stop:
+            for v in vehicles:
+                try:
+                    if timed(v.data_request, None)["state"] != "online":
+                        timed(v.wake_up)
+                    elif args.section == "all":
+                        timed(v.data_all)
+                    else:
+                        timed(v.data_request, args.section)
+                    with lock:
+                        counts["polls"] += 1
+                except (teslajson.HTTPError, teslajson.URLError, socket.error):
+                    with lock:
+                        counts["errors"] += 1
+
+    threads = [threading.Thread(target=poll, args=(c.vehicles[i::args.threads],)) for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return counts["polls"], sorted(latencies), counts["errors"]
+
+
+
+def run_poller(args, client):
+    """Run tesla_poller on every vehicle for args.duration, returning (polls, latencies, errors) from the server"""
+
+    outdir = tempfile.mkdtemp(prefix="tesla_bench")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    cmd_address = "127.0.0.1:%d" % sock.getsockname()[1]
+    sock.close()
+
+    server_stats(client, reset=True)
+    command = shlex.split(args.python) + [args.poller, "--token", "bench", "--tesla_client", json.dumps(client), "--no_validate_baseurl",
+                                          "--outdir", outdir, "--cmd_address", cmd_address] + shlex.split(args.poller_args)
+    poller = subprocess.Popen(command)
+    time.sleep(args.duration)
+
+    # Ask it to quit like poller_rpc.py would, then insist
+    stats = server_stats(client)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.sendto(json.dumps({"cmd": "quit", "carid": 90000000}).encode('utf-8'), ("127.0.0.1", int(cmd_address.split(":")[1])))
+    for i in range(100):
+        if poller.poll() is not None:
+            break
+        time.sleep(0.1)
+    else:
+        poller.terminate()
+    poller.wait()
+
+    written = sum([os.path.getsize(os.path.join(outdir, f)) for f in os.listdir(outdir) if not os.path.islink(os.path.join(outdir, f))])
+    shutil.rmtree(outdir)
+    print("poller wrote %d bytes" % written)
+
+    polls = sum([count for endpoint, count in stats["endpoints"].items() if endpoint == "data" or endpoint.startswith("data_request/")])
+    return polls, [stats["p50"], stats["p99"]], stats["errors"]
+
+
+
+def run_parser(args):
+    """Time the parser stages over args.logs (or a generated log), returning [(stage, seconds)] and the record count"""
+
+    # tesla_parselib is Python 2 only, like tesla-parser.py
+    import tesla_parselib
+    import tesla_loggen
+
+    args.json = args.json or tesla_parselib.json_backend
+    tesla_parselib.set_json_backend(args.json)
+
+    tmpdir = None
+    if not args.logs:
+        tmpdir = tempfile.mkdtemp(prefix="tesla_bench")
+        args.logs = [os.path.join(tmpdir, "generated.json")]
+        tesla_loggen.write_log(tesla_loggen.generate(args.vehicles, args.days, seed=1), args.logs[0])
+
+    stages = ("read", "decode", "extract", "mode", "merge", "sessions", "sql", "output")
+    times = dict([(stage, 0.0) for stage in stages])
+    records = 0
+    segmenter = tesla_parselib.session_segmenter()
+    merged = {}
+    out = open(os.devnull, "w")
+
+    def timed(stage, call, items):
+        start = time.time()
+        result = call(items)
+        times[stage] += time.time() - start
+        return result
+
+    def extract(jlines):
+        result = []
+        for jline in jlines:
+            this = tesla_parselib.tesla_record()
+            this.jline = jline
+            for attr, path in tesla_parselib.FIELDS:
+                getattr(this, attr)
+            result.append(this)
+        return result
+
+    def merge(these):
+        for this in these:
+            last = merged.get(this.vehicle_id)
+            merged[this.vehicle_id] = last + this if last else this
+
+    for fname in args.logs:
+        decoder = tesla_parselib.delta_decoder()
+        with tesla_parselib.open_log(fname) as R:
+            while True:
+                # A chunk at a time, each stage over the whole chunk
+                lines = timed("read", lambda R: list(itertools.islice(R, 10000)), R)
+                if not lines:
+                    break
+                jlines = timed("decode", lambda lines: [j for j in [tesla_parselib.decode_line(line, decoder=decoder) for line in lines] if j is not None], lines)
+                these = timed("extract", extract, jlines)
+                timed("mode", lambda these: [this.mode for this in these], these)
+                for this in these:
+                    this.jline = None
+                timed("merge", merge, these)
+                timed("sessions", lambda these: [segmenter.feed(this) for this in these], these)
+                timed("sql", lambda these: [this.sql_vehicle_status_insert_dict() for this in these], these)
+                timed("output", lambda lines: [out.write(line) for line in lines], lines)
+                records += len(these)
+
+    out.close()
+    if tmpdir:
+        shutil.rmtree(tmpdir)
+    return [(stage, times[stage]) for stage in stages], records
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', default="client", choices=("client", "poller", "parser"), help='What to load test')
+    parser.add_argument('--vehicles', default=10, type=int, help='Number of simulated vehicles')
+    parser.add_argument('--days', default=7, type=float, help='parser: days of log to generate without --logs')
+    parser.add_argument('--logs', nargs='*', help='parser: tesla_poller logs to parse (default: generate one)')
+    parser.add_argument('--json', default=None, help='parser: json decoder for tesla_parselib (default: the fastest installed)')
+    parser.add_argument('--duration', default=30, type=float, help='Seconds to run for')
+    parser.add_argument('--cycle', default=600, type=float, help='Seconds for a simulated vehicle to go through sleeping, driving and charging')
+    parser.add_argument('--latency', default=0, type=float, help='Mean extra seconds the server takes per response')
+    parser.add_argument('--error_rate', default=0, type=float, help='Fraction of requests failing with a 5xx error')
+    parser.add_argument('--threads', default=4, type=int, help='client: number of polling threads')
+    parser.add_argument('--retries', default=3, type=int, help='client: retries on failure')
+    parser.add_argument('--section', default="charge_state", help='client: data_request to poll ("all" for data_all)')
+    parser.add_argument('--poller', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "tesla_poller"), help='poller: path to tesla_poller')
+    parser.add_argument('--python', default="python2", help='poller: interpreter to run it with')
+    parser.add_argument('--poller_args', default="", help='poller: extra arguments, such as --intervals')
+    args = parser.parse_args()
+
+    if args.target == "parser":
+        stages, records = run_parser(args)
+        total = sum([seconds for stage, seconds in stages])
+        print("parser: %d records in %.2fs, %.0f records/sec (json=%s)" % (records, total, records / max(total, 1e-9), args.json))
+        for stage, seconds in stages:
+            print("  %-9s %7.2fs %10.0f records/sec %5.1f%%" % (stage, seconds, records / max(seconds, 1e-9), seconds * 100 / max(total, 1e-9)))
+        print("peak rss=%.1fMB" % usage(resource.RUSAGE_SELF)[1])
+        sys.exit(0)
+
+    server, client = start_server(args)
+    try:
+        if args.target == "client":
+            cpu, rss = usage(resource.RUSAGE_SELF)
+            polls, latencies, errors = run_client(args, client)
+            cpu = usage(resource.RUSAGE_SELF)[0] - cpu
+            rss = usage(resource.RUSAGE_SELF)[1]
+            p50, p99 = percentile(latencies, 0.50), percentile(latencies, 0.99)
+        else:
+            polls, (p50, p99), errors = run_poller(args, client)
+            cpu, rss = usage(resource.RUSAGE_CHILDREN)
+        stats = server_stats(client)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print("%s: %d vehicles for %.0fs" % (args.target, args.vehicles, args.duration))
+    print("polls=%d polls/sec=%.1f errors=%d" % (polls, polls / args.duration, errors))
+    if p50 is not None:
+        print("latency p50=%.1fms p99=%.1fms" % (p50 * 1000, p99 * 1000))
+    print("cpu=%.2fs (%.1f%% of a core) rss=%.1fMB" % (cpu, cpu * 100 / args.duration, rss))
+    print("server requests=%d: %s" % (stats["requests"], ", ".join(["%s=%d" % kv for kv in sorted(stats["endpoints"].items())])))
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+""" Generate synthetic tesla_poller logs, for benchmarks and tests
+
+Simulates a fleet of vehicles (the tesla_mockserver.py simulation, on
+a daily cycle of sleeping, commuting, parking and charging) and writes
+the records tesla_poller would have logged, polling each vehicle at
+the default tesla_poller intervals for what it is doing, interleaved
+in time order.  Any size of log can be made,
+from a day of one vehicle to a year of a large fleet.
+
+Example:
+
+./tesla_loggen.py --vehicles 500 --days 7 --output /tmp/fleet.json
+./tesla_loggen.py --days 365 --format jsonz --delta 3600 --output /tmp/year.jsonz
+"""
+
+import sys
+import json
+import time
+import heapq
+import random
+import argparse
+import datetime
+
+import tesla_parselib
+from tesla_mockserver import mock_vehicle
+
+
+# A day: night, commute, work, commute, errands, charging, evening
+DAY = ((0.30, "asleep"), (0.33, "parked"), (0.34, "prep"), (0.36, "driving"), (0.70, "parked"), (0.71, "prep"),
+       (0.73, "driving"), (0.78, "parked"), (0.79, "driving"), (0.80, "parked"), (0.88, "charging"), (1.00, "parked"))
+
+# Seconds between polls and between all-data polls by what the vehicle is doing (as tesla_poller's intervals)
+POLL = { "asleep": 60, "parked": 150, "recent": 60, "prep": 60, "driving": 30, "charging": 90 }
+POLL_ALL = { "recent": 0, "prep": 0, "driving": 300, "charging": 900 }
+POLL_ALL_DEFAULT = 10000
+
+# Seconds a parked vehicle is polled as recently active
+RECENT = 500
+
+# What a poll asks for besides the vehicle summary
+POLL_SECTION = { "driving": "drive_state", "charging": "charge_state" }
+
+
+
+def generate(vehicles=1, days=1, start=None, seed=None):
+    """Yield the records of a synthetic fleet log, in time order"""
+
+    rng = random.Random(seed)
+    if start is None:
+        start = time.mktime(datetime.date.today().timetuple()) - days * 86400
+    end = start + days * 86400
+
+    fleet = [mock_vehicle(i, cycle=86400, rng=rng, phases=DAY) for i in range(vehicles)]
+    heap = []
+    for v in fleet:
+        v.updated = start
+        v.last_all = v.last_active = 0
+        heapq.heappush(heap, (start + rng.uniform(0, 60), v.id, v))
+
+    while heap:
+        now, vid, v = heapq.heappop(heap)
+        if now >= end:
+            continue
+        v.update(now)
+
+        phase = v.phase if v.awake(now) else "asleep"
+        if phase in ("prep", "driving", "charging"):
+            v.last_active = now
+        elif phase == "parked" and now - v.last_active < RECENT:
+            phase = "recent"
+
+        if phase != "asleep" and now - v.last_all >= POLL_ALL.get(phase, POLL_ALL_DEFAULT):
+            vdata = v.data(now)
+            v.last_all = now
+        else:
+            vdata = v.summary(now)
+            if phase in POLL_SECTION:
+                vdata[POLL_SECTION[phase]] = getattr(v, POLL_SECTION[phase])(now)
+        vdata["retrevial_time"] = int(now)
+        yield vdata
+
+        heapq.heappush(heap, (now + POLL[phase] + rng.uniform(0, 2), vid, v))
+
+
+
+def write_log(records, out, format="json", delta=0):
+    """Write records to the file named out (or a stream), as tesla_poller would, returning how many"""
+
+    encoder = tesla_parselib.delta_encoder(delta) if delta else None
+    if format == "jsonz":
+        W = tesla_parselib.block_writer(out)
+    elif isinstance(out, str):
+        W = open(out, "w")
+    else:
+        W = out
+
+    count = 0
+    for vdata in records:
+        W.write((encoder.encode(vdata) if encoder else json.dumps(vdata)) + "\n")
+        count += 1
+
+    if W is not out:
+        W.close()
+    return count
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vehicles', default=1, type=int, help='Number of vehicles')
+    parser.add_argument('--days', default=7, type=float, help='Days of log to generate')
+    parser.add_argument('--start', default=None, type=str, help='First day (YYYY-MM-DD, default: --days before today)')
+    parser.add_argument('--seed', default=1, type=int, help='Random seed, the same seed makes the same log')
+    parser.add_argument('--format', default="json", choices=("json", "jsonz"), help='Output file format (jsonz needs --output)')
+    parser.add_argument('--delta', default=0, type=int, help='Write only changed fields, with a full record every this many seconds')
+    parser.add_argument('--output', '-o', default=None, help='File to write (default standard output)')
+    args = parser.parse_args()
+
+    if args.format == "jsonz" and not args.output:
+        parser.error("--format jsonz needs --output")
+
+    start = None
+    if args.start:
+        start = time.mktime(time.strptime(args.start, "%Y-%m-%d"))
+
+    count = write_log(generate(args.vehicles, args.days, start, args.seed), args.output or sys.stdout, args.format, args.delta)
+    sys.stderr.write("%d records\n" % count)
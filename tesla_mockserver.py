@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+""" Local stand-in for the Tesla JSON API, for testing and load testing
+
+Serves the endpoints teslajson.Connection and Vehicle use
+(oauth/token, vehicles, vehicles/ID, vehicles/ID/data,
+vehicles/ID/data_request/NAME, vehicles/ID/wake_up and
+vehicles/ID/command/NAME) for simulated vehicles which sleep, wake,
+drive and charge in a repeating cycle, each at its own point of the
+cycle.  Responses may be delayed and may fail at random.  Any bearer
+token is accepted.
+
+GET /stats returns request counts per endpoint, errors and handling
+times (including the simulated latency); /stats?reset=1 also clears
+them.
+
+Example:
+
+./tesla_mockserver.py --vehicles 10 --port 8080 &
+./teslajson.py --access_token x --tesla_client '{"v1": {"baseurl": "http://127.0.0.1:8080", "api": "/api/1/", "id": "x", "secret": "x"}}' --no_validate_baseurl get charge_state
+"""
+
+try: # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except: # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+import argparse
+import json
+import math
+import random
+import socket
+import sys
+import threading
+import time
+
+
+# Where each part of the cycle ends, as a fraction of it
+PHASES = ((0.40, "asleep"), (0.45, "parked"), (0.48, "prep"), (0.60, "driving"),
+          (0.65, "parked"), (0.85, "charging"), (1.00, "parked"))
+
+# The data_request sections, all of which make up the data response
+SECTIONS = ("charge_state", "climate_state", "drive_state", "vehicle_state", "vehicle_config", "gui_settings")
+
+
+
+class mock_vehicle(object):
+    """One simulated vehicle, advanced to the current time whenever it is looked at"""
+
+    def __init__(self, index, cycle=3600, wake_delay=0, rng=random, phases=PHASES):
+        self.id = 90000000 + index
+        self.vehicle_id = 1000 + index
+        self.vin = "5YJSMOCK%09d" % index
+        self.display_name = "Mock %d" % index
+        self.cycle = cycle
+        self.phases = phases
+        self.wake_delay = wake_delay
+        self.offset = rng.random() * cycle
+
+        self.battery_level = rng.uniform(40, 90)
+        self.charge_limit_soc = 80
+        self.charge_energy_added = 0.0
+        self.charge_miles_added = 0.0
+        self.odometer = rng.uniform(1000, 50000)
+        self.latitude = rng.uniform(37.2, 37.6)
+        self.longitude = rng.uniform(-122.3, -121.8)
+        self.heading = rng.randint(0, 359)
+        self.speed = None
+        self.locked = True
+        self.climate = None
+        self.charging = None
+        self.phase = None
+
+        self.awake_until = 0
+        self.wake_at = None
+        self.updated = time.time()
+
+
+
+    def _phase(self, now):
+        where = ((now + self.offset) % self.cycle) / self.cycle
+        for end, phase in self.phases:
+            if where < end:
+                return phase
+        return self.phases[-1][1]
+
+
+
+    def update(self, now):
+        """Advance the simulation to now"""
+
+        phase = self._phase(now)
+        dt = max(0, now - self.updated)
+        self.updated = now
+
+        if self.wake_at is not None and now >= self.wake_at:
+            self.wake_at = None
+            self.awake_until = now + min(600, self.cycle * 0.1)
+
+        if phase == "charging" and self.phase != "charging":
+            self.charge_energy_added = self.charge_miles_added = 0.0
+        self.phase = phase
+
+        self.speed = None
+        if phase == "driving":
+            self.locked = False
+            self.speed = int(45 + 20 * math.sin(now / 60.0))
+            miles = self.speed * dt / 3600.0
+            self.odometer += miles
+            self.battery_level = max(0.0, self.battery_level - miles * 0.3)
+            self.heading = (self.heading + int(dt)) % 360
+            self.latitude += miles / 69.0 * math.cos(math.radians(self.heading))
+            self.longitude += miles / 55.0 * math.sin(math.radians(self.heading))
+        elif self.plugged_in():
+            if self.battery_level < self.charge_limit_soc:
+                # 11kW into a 75kWh pack
+                added = min(self.charge_limit_soc - self.battery_level, 11.0 / 75 * 100 * dt / 3600)
+                self.battery_level += added
+                self.charge_energy_added += added * 0.75
+                self.charge_miles_added += added * 3.1
+        else:
+            self.locked = True
+
+
+
+    def plugged_in(self):
+        """Charging, or done charging, by the cycle or by command"""
+        return self.charging if self.charging is not None else self.phase == "charging"
+
+
+
+    def awake(self, now):
+        return self._phase(now) != "asleep" or now < self.awake_until
+
+
+
+    def wake_up(self, now):
+        if not self.awake(now) and self.wake_at is None:
+            self.wake_at = now + self.wake_delay
+            self.update(now)
+
+
+
+    def summary(self, now):
+        return { "id": self.id, "vehicle_id": self.vehicle_id, "vin": self.vin, "display_name": self.display_name,
+                 "option_codes": "MDLS,RENA,AF02,APF1,APH2,APPB,AU01,BC0R,BP00,BR00,BS00,CDM0,CH05,PBCW,CW00",
+                 "color": None, "tokens": ["mock", "mock"], "state": "online" if self.awake(now) else "asleep",
+                 "in_service": False, "id_s": str(self.id), "calendar_enabled": True, "api_version": 6,
+                 "backseat_token": None, "backseat_token_updated_at": None }
+
+
+
+    def charge_state(self, now):
+        charging = self.plugged_in()
+        complete = charging and self.battery_level >= self.charge_limit_soc
+        power = 11 if charging and not complete else 0
+        return { "charging_state": "Complete" if complete else "Charging" if charging else "Disconnected",
+                 "battery_level": int(self.battery_level), "usable_battery_level": int(self.battery_level),
+                 "battery_range": round(self.battery_level * 2.65, 2), "est_battery_range": round(self.battery_level * 2.3, 2),
+                 "ideal_battery_range": round(self.battery_level * 3.1, 2), "charge_limit_soc": self.charge_limit_soc,
+                 "charge_energy_added": round(self.charge_energy_added, 2), "charge_miles_added_rated": round(self.charge_miles_added, 1),
+                 "charge_miles_added_ideal": round(self.charge_miles_added * 1.15, 1), "charge_current_request": 32,
+                 "charge_current_request_max": 48, "charger_power": power, "charger_voltage": 240 if power else 0,
+                 "charger_actual_current": 46 if power else 0, "charge_rate": 30.0 if power else 0.0,
+                 "time_to_full_charge": round(max(0, self.charge_limit_soc - self.battery_level) / (11.0 / 75 * 100), 2) if power else 0.0,
+                 "charge_port_door_open": charging, "fast_charger_present": False, "battery_heater_on": False,
+                 "scheduled_charging_pending": False, "timestamp": int(now * 1000) }
+
+
+
+    def climate_state(self, now):
+        on = self.climate if self.climate is not None else self.phase in ("prep", "driving")
+        return { "is_climate_on": on, "inside_temp": 21.5 if on else 17.0, "outside_temp": 14.5,
+                 "driver_temp_setting": 21.0, "passenger_temp_setting": 21.0, "is_auto_conditioning_on": on,
+                 "is_front_defroster_on": False, "is_rear_defroster_on": False, "fan_status": 3 if on else 0,
+                 "seat_heater_left": 0, "seat_heater_right": 0, "battery_heater": False,
+                 "is_preconditioning": self.phase == "prep", "timestamp": int(now * 1000) }
+
+
+
+    def drive_state(self, now):
+        return { "shift_state": "D" if self.speed is not None else None, "speed": self.speed, "power": 20 if self.speed else 0,
+                 "latitude": round(self.latitude, 6), "longitude": round(self.longitude, 6), "heading": self.heading,
+                 "gps_as_of": int(now), "timestamp": int(now * 1000) }
+
+
+
+    def vehicle_state(self, now):
+        return { "locked": self.locked, "odometer": round(self.odometer, 6), "is_user_present": self.phase in ("prep", "driving"),
+                 "valet_mode": False, "car_version": "2019.20.4.2 1", "api_version": 6, "autopark_state_v2": "standby",
+                 "center_display_state": 2 if self.speed else 0, "df": 0, "dr": 0, "pf": 0, "pr": 0, "ft": 0, "rt": 0,
+                 "sentry_mode": False, "remote_start": False, "timestamp": int(now * 1000) }
+
+
+
+    def vehicle_config(self, now):
+        return { "car_type": "models2", "car_special_type": "base", "perf_config": "P2", "has_ludicrous_mode": False,
+                 "wheel_type": "Base19", "has_air_suspension": True, "exterior_color": "White",
+                 "charge_port_type": "US", "rhd": False, "roof_color": "None", "spoiler_type": "None",
+                 "timestamp": int(now * 1000) }
+
+
+
+    def gui_settings(self, now):
+        return { "gui_distance_units": "mi/hr", "gui_temperature_units": "F", "gui_charge_rate_units": "mi/hr",
+                 "gui_24_hour_time": False, "gui_range_display": "Rated", "timestamp": int(now * 1000) }
+
+
+
+    def data(self, now):
+        data = self.summary(now)
+        for name in SECTIONS:
+            data[name] = getattr(self, name)(now)
+        return data
+
+
+
+    def command(self, name, params):
+        """Apply a command, returning its result"""
+
+        if name in ("charge_start", "charge_stop"):
+            self.charging = name == "charge_start"
+        elif name in ("auto_conditioning_start", "auto_conditioning_stop"):
+            self.climate = name == "auto_conditioning_start"
+        elif name == "set_charge_limit":
+            self.charge_limit_soc = int(params.get("percent", [self.charge_limit_soc])[0])
+        elif name in ("door_lock", "door_unlock"):
+            self.locked = name == "door_lock"
+        return { "result": True, "reason": "" }
+
+
+
+class mock_fleet(object):
+    """Simulated vehicles plus the failure settings and statistics of the server"""
+
+    def __init__(self, vehicles=1, cycle=3600, wake_delay=0, latency=0, error_rate=0, seed=None):
+        rng = random.Random(seed)
+        self.vehicles = [mock_vehicle(i, cycle=cycle, wake_delay=wake_delay, rng=rng) for i in range(vehicles)]
+        self.by_id = dict([(v.id, v) for v in self.vehicles])
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.reset()
+
+
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counts = {}
+            self.errors = 0
+            self.times = []
+
+
+
+    def record(self, endpoint, elapsed, failed):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.errors += failed
+            self.times.append(elapsed)
+
+
+
+    def stats(self):
+        with self.lock:
+            times = sorted(self.times)
+            return { "elapsed": time.time() - self.started, "requests": len(times), "errors": self.errors,
+                     "endpoints": dict(self.counts), "p50": percentile(times, 0.50), "p99": percentile(times, 0.99) }
+
+
+
+    def delay(self):
+        """Seconds to hold a response, and whether it should fail"""
+
+        with self.lock:
+            delay = self.rng.expovariate(1.0 / self.latency) if self.latency > 0 else 0
+            return delay, self.rng.random() < self.error_rate
+
+
+
+def percentile(values, fraction):
+    """The fraction (0 to 1) percentile of sorted values, None if there are none"""
+    if not values:
+        return None
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+
+class mock_handler(BaseHTTPRequestHandler):
+    """Route requests to the fleet of the server"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "tesla_mockserver"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body are written separately, do not wait for an ack in between
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+
+    def do_GET(self):
+        self._handle("GET")
+
+
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+
+    def _reply(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+
+    def _handle(self, method):
+        start = time.time()
+        fleet = self.server.fleet
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        params = parse_qs(self.rfile.read(length).decode('utf-8')) if length else {}
+
+        if parts.path == "/stats":
+            stats = fleet.stats()
+            if "reset" in parse_qs(parts.query):
+                fleet.reset()
+            return self._reply(200, stats)
+
+        endpoint, status, response = self._route(method, parts.path, params, fleet)
+
+        delay, fail = fleet.delay()
+        if delay:
+            time.sleep(delay)
+        if fail and status == 200:
+            status, response = self.server.fleet.rng.choice((500, 502, 503, 504)), { "response": None, "error": "mock failure" }
+
+        self._reply(status, response)
+        fleet.record(endpoint, time.time() - start, status != 200)
+
+
+
+    def _route(self, method, path, params, fleet):
+        """Return (endpoint name for the statistics, status, response)"""
+
+        if path == "/oauth/token":
+            now = int(time.time())
+            return "oauth/token", 200, { "access_token": "mock-access-%d" % now, "refresh_token": "mock-refresh-%d" % now,
+                                         "token_type": "bearer", "created_at": now, "expires_in": 45 * 86400 }
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return "unauthorized", 401, { "response": None, "error": "unauthorized" }
+
+        words = path.strip("/").split("/")
+        if words[:2] != ["api", "1"] or len(words) < 3 or words[2] != "vehicles":
+            return "unknown", 404, { "response": None, "error": "not found" }
+
+        now = time.time()
+        with fleet.lock:
+            if len(words) == 3:
+                return "vehicles", 200, { "response": [v.summary(now) for v in fleet.vehicles], "count": len(fleet.vehicles) }
+
+            try:
+                vehicle = fleet.by_id[int(words[3])]
+            except (KeyError, ValueError):
+                return "unknown", 404, { "response": None, "error": "not_found" }
+            vehicle.update(now)
+            rest = words[4:]
+
+            if not rest:
+                return "vehicle", 200, { "response": vehicle.summary(now) }
+            if rest == ["wake_up"]:
+                vehicle.wake_up(now)
+                return "wake_up", 200, { "response": vehicle.summary(now) }
+
+            if rest[0] in ("data", "vehicle_data"):
+                endpoint = "data"
+            elif rest[0] == "data_request" and len(rest) == 2 and rest[1] in SECTIONS:
+                endpoint = "data_request/%s" % rest[1]
+            elif rest[0] == "command" and len(rest) == 2 and method == "POST":
+                endpoint = "command/%s" % rest[1]
+            else:
+                return "unknown", 404, { "response": None, "error": "not found" }
+
+            if not vehicle.awake(now):
+                return endpoint, 408, { "response": None, "error": "vehicle unavailable: {:error=>\"vehicle unavailable:\"}" }
+            if endpoint == "data":
+                return endpoint, 200, { "response": vehicle.data(now) }
+            if rest[0] == "data_request":
+                return endpoint, 200, { "response": getattr(vehicle, rest[1])(now) }
+            return endpoint, 200, { "response": vehicle.command(rest[1], params) }
+
+
+
+class mock_server(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server for a mock_fleet"""
+
+    daemon_threads = True
+
+    def __init__(self, address, fleet, verbose=False):
+        HTTPServer.__init__(self, address, mock_handler)
+        self.fleet = fleet
+        self.verbose = verbose
+
+
+
+    def client(self):
+        """The tesla_client description to give teslajson for this server"""
+        return { "v1": { "baseurl": "http://%s:%d" % self.server_address[:2], "api": "/api/1/", "id": "mock", "secret": "mock" } }
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--verbose', '-v', action='count', help='Log every request')
+    parser.add_argument('--address', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', default=8080, type=int, help='Port to listen on (0: any free port)')
+    parser.add_argument('--vehicles', default=1, type=int, help='Number of simulated vehicles')
+    parser.add_argument('--cycle', default=3600, type=float, help='Seconds for a vehicle to go through sleeping, driving and charging')
+    parser.add_argument('--wake_delay', default=0, type=float, help='Seconds from wake_up to a sleeping vehicle being online')
+    parser.add_argument('--latency', default=0, type=float, help='Mean extra seconds before each response (exponentially distributed)')
+    parser.add_argument('--error_rate', default=0, type=float, help='Fraction of requests failing with a 5xx error')
+    parser.add_argument('--seed', default=None, type=int, help='Random seed for the simulation')
+    args = parser.parse_args()
+
+    fleet = mock_fleet(vehicles=args.vehicles, cycle=args.cycle, wake_delay=args.wake_delay, latency=args.latency,
+                       error_rate=args.error_rate, seed=args.seed)
+    server = mock_server((args.address, args.port), fleet, verbose=args.verbose)
+
+    # The first line tells the port, and the client description to use
+    print(json.dumps(server.client()))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
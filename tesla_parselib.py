@@ -3,110 +3,372 @@
 # Parse the tesla json records
 #
 
+import os
+import re
 import json
-import copy
-from datetime import datetime
+import time
+import zlib
+import array
+import select
+import ctypes
+import ctypes.util
+import collections
+from datetime import datetime, timedelta
 import tzlocal
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-class tesla_record(object):
-    """Abbreviated information about a specific record retrieved from a tesla"""
-    def __init__(self, line, want_offline=False):
-        """Create object from json text data from tesla_poller"""
-
-        # self.jline set in new
-        self.time = 			self.jline["retrevial_time"]
-        self.vehicle_id = 		self.jline["vehicle_id"]
-        self.state = 			self.jline["state"]
-        self.car_locked = 		self._jget(["vehicle_state", "locked"])
-        self.odometer =			self._jget(["vehicle_state", "odometer"])
-        self.is_user_present =		self._jget(["vehicle_state", "is_user_present"])
-        self.valet_mode =		self._jget(["vehicle_state", "valet_mode"])
-        self.charging_state =		self._jget(["charge_state",  "charging_state"])
-        self.usable_battery_level =	self._jget(["charge_state",  "usable_battery_level"])
-        self.charge_miles_added =	self._jget(["charge_state",  "charge_miles_added_rated"])
-        self.charge_energy_added =	self._jget(["charge_state",  "charge_energy_added"])
-        self.charge_current_request =	self._jget(["charge_state",  "charge_current_request"])
-        self.charger_power =		self._jget(["charge_state",  "charger_power"])
-        self.charge_rate =		self._jget(["charge_state",  "charge_rate"])
-        self.charger_voltage =		self._jget(["charge_state",  "charger_voltage"])
-        self.battery_range =		self._jget(["charge_state",  "battery_range"])
-        self.est_battery_range =	self._jget(["charge_state",  "est_battery_range"])
-        self.shift_state =		self._jget(["drive_state",   "shift_state"])
-        self.speed =			self._jget(["drive_state",   "speed"])
-        self.latitude =			self._jget(["drive_state",   "latitude"])
-        self.longitude =		self._jget(["drive_state",   "longitude"])
-        self.heading =			self._jget(["drive_state",   "heading"])
-        self.gps_as_of =		self._jget(["drive_state",   "gps_as_of"])
-        self.climate_on =		self._jget(["climate_state", "is_climate_on"])
-        self.inside_temp =		self._jget(["climate_state", "inside_temp"])
-        self.outside_temp =		self._jget(["climate_state", "outside_temp"])
-        self.battery_heater =		self._jget(["climate_state", "battery_heater"])
-        self.vin =			self.jline["vin"]
-        self.display_name =		self.jline["display_name"]
-        self.car_type =			self._jget(["vehicle_config", "car_type"])
-        self.car_special_type =		self._jget(["vehicle_config", "car_special_type"])
-        self.perf_config =		self._jget(["vehicle_config", "perf_config"])
-        self.has_ludicrous_mode =	self._jget(["vehicle_config", "has_ludicrous_mode"])
-        self.wheel_type =		self._jget(["vehicle_config", "wheel_type"])
-        self.has_air_suspension =	self._jget(["vehicle_config", "has_air_suspension"])
-        self.exterior_color =		self._jget(["vehicle_config", "exterior_color"])
-        self.option_codes =		self.jline["option_codes"]
-        self.car_version =		self._jget(["vehicle_state", "car_version"])
-        
-
-        if self.charger_power > 0:
-            self.mode = "Charging"
-        elif self.shift_state and self.shift_state != "P":
-            self.mode = "Driving"
-        elif self.climate_on:
-            self.mode = "Conditioning"
-        elif self.charger_power is not None or self.odometer is not None:
-            self.mode = "Standby"
-        else:
-            self.mode = "Polling"
+# Faster json decoders, the first one installed is used by decode_line
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
 
-    def __new__(cls, line=None, want_offline=False):
-        """Return None if this isn't what we want"""
+JSON_DECODERS = {"json": json.loads}
+if simdjson is not None:
+    JSON_DECODERS["simdjson"] = simdjson.loads
+if orjson is not None:
+    JSON_DECODERS["orjson"] = orjson.loads
+json_backend = "orjson" if orjson else "simdjson" if simdjson else "json"
 
-        if line is not None and (line.startswith("#") or len(line) < 10):
-            return None
 
-        instance = super(tesla_record, cls).__new__(cls)
+# Record attribute name and where it is found in the tesla_poller json document
+FIELDS = (
+    ("time",			("retrevial_time",)),
+    ("vehicle_id",		("vehicle_id",)),
+    ("state",			("state",)),
+    ("car_locked",		("vehicle_state",  "locked")),
+    ("odometer",		("vehicle_state",  "odometer")),
+    ("is_user_present",		("vehicle_state",  "is_user_present")),
+    ("valet_mode",		("vehicle_state",  "valet_mode")),
+    ("charging_state",		("charge_state",   "charging_state")),
+    ("usable_battery_level",	("charge_state",   "usable_battery_level")),
+    ("charge_miles_added",	("charge_state",   "charge_miles_added_rated")),
+    ("charge_energy_added",	("charge_state",   "charge_energy_added")),
+    ("charge_current_request",	("charge_state",   "charge_current_request")),
+    ("charger_power",		("charge_state",   "charger_power")),
+    ("charge_rate",		("charge_state",   "charge_rate")),
+    ("charger_voltage",		("charge_state",   "charger_voltage")),
+    ("battery_range",		("charge_state",   "battery_range")),
+    ("est_battery_range",	("charge_state",   "est_battery_range")),
+    ("shift_state",		("drive_state",    "shift_state")),
+    ("speed",			("drive_state",    "speed")),
+    ("latitude",		("drive_state",    "latitude")),
+    ("longitude",		("drive_state",    "longitude")),
+    ("heading",			("drive_state",    "heading")),
+    ("gps_as_of",		("drive_state",    "gps_as_of")),
+    ("climate_on",		("climate_state",  "is_climate_on")),
+    ("inside_temp",		("climate_state",  "inside_temp")),
+    ("outside_temp",		("climate_state",  "outside_temp")),
+    ("battery_heater",		("climate_state",  "battery_heater")),
+    ("vin",			("vin",)),
+    ("display_name",		("display_name",)),
+    ("car_type",		("vehicle_config", "car_type")),
+    ("car_special_type",	("vehicle_config", "car_special_type")),
+    ("perf_config",		("vehicle_config", "perf_config")),
+    ("has_ludicrous_mode",	("vehicle_config", "has_ludicrous_mode")),
+    ("wheel_type",		("vehicle_config", "wheel_type")),
+    ("has_air_suspension",	("vehicle_config", "has_air_suspension")),
+    ("exterior_color",		("vehicle_config", "exterior_color")),
+    ("option_codes",		("option_codes",)),
+    ("car_version",		("vehicle_state",  "car_version")),
+    )
+FIELD_PATHS = dict(FIELDS)
+
+# Modes a record may be classified as, and their codes in columnar data
+MODES = ("Polling", "Standby", "Conditioning", "Driving", "Charging")
+MODE_CODES = dict([(m, i) for i, m in enumerate(MODES)])
+
+# Codes for shift_state in columnar data (-1 for any other value)
+SHIFT_STATES = (None, "P", "R", "N", "D")
+SHIFT_CODES = dict([(s, i) for i, s in enumerate(SHIFT_STATES)])
+
+# Columns produced by load_columns, with their array typecode
+# (floats use NaN and booleans -1 for missing values)
+COLUMNS = (
+    ("time", "l"), ("vehicle_id", "l"),
+    ("odometer", "d"), ("speed", "d"), ("latitude", "d"), ("longitude", "d"), ("heading", "d"), ("gps_as_of", "d"),
+    ("usable_battery_level", "d"), ("battery_range", "d"), ("est_battery_range", "d"),
+    ("charge_rate", "d"), ("charger_power", "d"), ("charger_voltage", "d"), ("charge_current_request", "d"),
+    ("charge_miles_added", "d"), ("charge_energy_added", "d"),
+    ("inside_temp", "d"), ("outside_temp", "d"),
+    ("car_locked", "b"), ("is_user_present", "b"), ("valet_mode", "b"), ("climate_on", "b"), ("battery_heater", "b"),
+    ("shift_state", "b"),
+    )
+
+
+# Columns of the vehicle_status table, as produced by sql_vehicle_status_insert_dict
+VEHICLE_STATUS_COLUMNS = (
+    "ts", "vehicle_id", "state", "car_locked", "odometer", "is_user_present", "shift_state", "speed",
+    "latitude", "longitude", "heading", "gps_as_of", "charging_state", "battery_level", "battery_range",
+    "est_battery_range", "charge_rate", "miles_added", "energy_added", "charge_current_request",
+    "charger_power", "charger_voltage", "inside_temp", "outside_temp", "climate_on", "battery_heater",
+    "valet_mode",
+    )
+
+
+# Session table for each mode, and its columns besides vehicle_id, start_ts and end_ts
+SESSION_TABLES = {
+    "Driving":		"drive_session",
+    "Charging":		"charge_session",
+    "Standby":		"idle_session",
+    "Conditioning":	"idle_session",
+    }
+SESSION_COLUMNS = {
+    "drive_session":	("distance", "battery_level", "level_used", "range_used", "efficiency"),
+    "charge_session":	("battery_level", "level_added", "range_added", "energy_added", "rate", "capacity", "max_range"),
+    "idle_session":	("mode", "battery_level", "level_used", "range_used", "rate"),
+    }
+
+
+# Columns of the vehicle table which are updated when a known value changes
+VEHICLE_UPDATE_COLUMNS = (
+    "car_type", "car_special_type", "perf_config", "has_ludicrous_mode", "wheel_type",
+    "has_air_suspension", "exterior_color", "option_codes", "car_version",
+    )
+
+
+
+def jget(jline, tree, notfound=None):
+    """Walk the json document jline down the list of keys in tree"""
+    info = jline
+    for key in tree:
+        if key not in info:
+            return notfound
+        info = info[key]
+    return info
+
 
-        if line is None:
-            return instance
 
+# Offsets from UTC of the local zone by quarter hour (zones change offset on quarter hours)
+_utc_offsets = {}
+_local_zone = None
+_EPOCH = datetime(1970, 1, 1)
+
+def local_datetime(unix_time):
+    """Naive local date and time for unix_time, as datetime.fromtimestamp(unix_time, tzlocal.get_localzone()) without the zone
+
+    The zone's offset from UTC is looked up once per quarter hour.
+    """
+
+    global _local_zone
+    quarter = int(unix_time // 900)
+    offset = _utc_offsets.get(quarter)
+    if offset is None:
+        if _local_zone is None:
+            _local_zone = tzlocal.get_localzone()
+        offset = _utc_offsets[quarter] = datetime.fromtimestamp(quarter * 900, _local_zone).utcoffset()
+    return _EPOCH + timedelta(seconds=unix_time) + offset
+
+
+
+def record_mode(charger_power, shift_state, climate_on, odometer):
+    """Classify what the vehicle is doing from a few record fields"""
+    if charger_power > 0:
+        return "Charging"
+    elif shift_state and shift_state != "P":
+        return "Driving"
+    elif climate_on:
+        return "Conditioning"
+    elif charger_power is not None or odometer is not None:
+        return "Standby"
+    else:
+        return "Polling"
+
+
+
+def set_json_backend(name):
+    """Make decode_line use the named decoder of JSON_DECODERS"""
+
+    global json_backend
+    if name not in JSON_DECODERS:
+        raise ValueError("json decoder %s is not installed (have %s)" % (name, ", ".join(sorted(JSON_DECODERS))))
+    json_backend = name
+
+
+
+def decode_line(line, want_offline=False, decoder=None):
+    """Return the json document for a tesla_poller line, or None if this isn't what we want
+
+    Delta lines (see delta_encoder) are rebuilt into full documents by
+    decoder, a delta_decoder fed every line of the file in order, and
+    are skipped without one.  Lines are decoded by json_backend, and by the json module if it refuses them.
+    """
+
+    if line.startswith("#") or len(line) < 10:
+        return None
+
+    try:
+        jline = JSON_DECODERS[json_backend](line)
+    except Exception as e:
         try:
-            instance.jline = json.loads(line)
+            jline = json.loads(line)
         except Exception as e:
             return None
 
-        if "retrevial_time" not in instance.jline:
+    if decoder is not None:
+        jline = decoder.decode(jline)
+        if jline is None:
             return None
+    elif "delta" in jline:
+        return None
+
+    if "retrevial_time" not in jline:
+        return None
+
+    if jline["state"] != "online" and not want_offline:
+        return None
+
+    return jline
 
-        if instance.jline["state"] != "online" and not want_offline:
+
+
+def load_columns(filenames, want_offline=False):
+    """Load tesla_poller log files into a dictionary of numpy column arrays
+
+    Uses the same field mapping and filtering as tesla_record, without
+    creating a record object per line.  Columns are listed in COLUMNS,
+    plus "mode" (an index into MODES, computed like tesla_record.mode).
+    shift_state is an index into SHIFT_STATES.
+    """
+
+    if numpy is None:
+        raise ImportError("load_columns requires numpy")
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    paths = [(name, code, FIELD_PATHS[name]) for name, code in COLUMNS]
+    buffers = dict([(name, array.array(code)) for name, code in COLUMNS])
+    nan = float("nan")
+
+    for fname in filenames:
+        decoder = delta_decoder()
+        with open_log(fname) as R:
+            for line in R:
+                jline = decode_line(line, want_offline=want_offline, decoder=decoder)
+                if jline is None:
+                    continue
+                for name, code, path in paths:
+                    value = jget(jline, path)
+                    if name == "shift_state":
+                        value = SHIFT_CODES.get(value, -1)
+                    elif value is None:
+                        value = nan if code == "d" else -1
+                    elif code == "b":
+                        value = 1 if value else 0
+                    buffers[name].append(value)
+
+    columns = dict([(name, numpy.frombuffer(buffers[name], dtype=buffers[name].typecode).copy())
+                    for name, code in COLUMNS])
+
+    # Vectorized tesla_record.mode
+    power = columns["charger_power"]
+    shift = columns["shift_state"]
+    mode = numpy.full(len(power), MODE_CODES["Polling"], dtype=numpy.int8)
+    mode[~numpy.isnan(power) | ~numpy.isnan(columns["odometer"])] = MODE_CODES["Standby"]
+    mode[columns["climate_on"] == 1] = MODE_CODES["Conditioning"]
+    mode[(shift != SHIFT_CODES[None]) & (shift != SHIFT_CODES["P"])] = MODE_CODES["Driving"]
+    mode[numpy.nan_to_num(power) > 0] = MODE_CODES["Charging"]
+    columns["mode"] = mode
+
+    return columns
+
+
+
+class tesla_record(object):
+    """Abbreviated information about a specific record retrieved from a tesla
+
+    Fields (see FIELDS) are extracted from the json document the first
+    time they are used.  release() extracts the rest and drops the
+    document; records produced by merging (+) never hold one.
+    """
+
+    __slots__ = ("jline", "mode") + tuple([attr for attr, path in FIELDS])
+
+    def __init__(self, line=None, want_offline=False, decoder=None):
+        """Create object from json text data from tesla_poller (see decode_line for decoder)"""
+
+        # self.jline set in new, fields extracted on demand by __getattr__
+        pass
+
+
+    def __new__(cls, line=None, want_offline=False, decoder=None):
+        """Return None if this isn't what we want"""
+
+        instance = super(tesla_record, cls).__new__(cls)
+        instance.jline = None
+
+        if line is None:
+            return instance
+
+        instance.jline = decode_line(line, want_offline=want_offline, decoder=decoder)
+        if instance.jline is None:
             return None
 
         return instance
 
+
+    def __getattr__(self, attr):
+        """Extract a field not yet used from the json document"""
+
+        if attr == "mode":
+            value = record_mode(self.charger_power, self.shift_state, self.climate_on, self.odometer)
+        elif attr in FIELD_PATHS and self.jline is not None:
+            value = jget(self.jline, FIELD_PATHS[attr])
+        elif attr in FIELD_PATHS:
+            value = None
+        else:
+            raise AttributeError(attr)
+
+        setattr(self, attr, value)
+        return value
+
+
+    def release(self):
+        """Extract all fields and drop the json document, returning self"""
+
+        if self.jline is not None:
+            for attr in self.__slots__:
+                getattr(self, attr)
+            self.jline = None
+        return self
+
+
+    def __getstate__(self):
+        """Pickle the extracted fields, not the json document"""
+        self.release()
+        return tuple([getattr(self, attr) for attr in self.__slots__[1:]])
+
+
+    def __setstate__(self, state):
+        self.jline = None
+        for attr, value in zip(self.__slots__[1:], state):
+            setattr(self, attr, value)
+
+
     def __add__(self, b):
-        result = copy.copy(self)
-        for attr in b.__dict__:
+        """Return a record with the fields of b, or ours where b's are empty"""
+
+        result = tesla_record()
+        for attr in self.__slots__[1:]:
             v = getattr(b, attr)
-            if v:
-                setattr(result, attr, v)
+            setattr(result, attr, v if v else getattr(self, attr))
         return result
 
 
     def _jget(self, tree, notfound=None):
-        info = self.jline
-        for key in tree:
-            if key not in info:
-                return notfound
-            info = info[key]
-        return info
+        if self.jline is None:
+            return notfound
+        return jget(self.jline, tree, notfound)
 
 
     def sql_vehicle_insert_dict(self):
@@ -139,59 +401,25 @@ class tesla_record(object):
 
 
     def sql_vehicle_update_dict(self, current) :
-	# construct a dictionary with keys and values to change, to be used in a psycopg2 
-	# update execute command. We assume vin never changes, so we don't check it
+        # construct a dictionary with keys and values to change, to be used in a psycopg2
+        # update execute command. current maps vehicle table column names to their values.
+        # We assume vin never changes, so we don't check it
         result = {}
         # check the display_name
-        if current[2] != self.display_name:
-	    result["display_name"]= self.display_name
-	# check car_type
-	if self.car_type is not None :
-	    if current[3] != self.car_type:
-		result["car_type"] = self.car_type
-	# check car_special_type
-	if self.car_special_type is not None :
-	    if current[4] != self.car_special_type:
-		result["car_special_type"] = self.car_special_type
-	# check perf_config
-	if self.perf_config is not None :
-	    if current[5] != self.perf_config:
-		result["perf_config"] = self.perf_config
-	# check has_ludicrous_mode
-	if self.has_ludicrous_mode is not None :
-	    if current[6] != self.has_ludicrous_mode:
-		result["has_ludicrous_mode"] = self.has_ludicrous_mode
-	# check wheel_type
-	if self.wheel_type is not None :
-	    if current[7] != self.wheel_type:
-		result["wheel_type"] = self.wheel_type
-	# check has_air_suspension
-	if self.has_air_suspension is not None :
-	    if current[8] != self.has_air_suspension:
-		result["has_air_suspension"] = self.has_air_suspension
-	# check exterior_color
-	if self.exterior_color is not None :
-	    if current[9] != self.exterior_color:
-		result["exterior_color"] = self.exterior_color
-	# check option_codes
-	if self.option_codes is not None :
-	    if current[10] != self.option_codes:
-		result["option_codes"] = self.option_codes
-	# check car_version
-	if self.car_version is not None :
-	    if current[11] != self.car_version:
-		result["car_version"] = self.car_version
-	return result
+        if current["display_name"] != self.display_name:
+            result["display_name"]= self.display_name
+        # check the other columns, if we know their value
+        for column in VEHICLE_UPDATE_COLUMNS:
+            value = getattr(self, column)
+            if value is not None and current[column] != value:
+                result[column] = value
+        return result
 
 
     def sql_vehicle_status_insert_dict(self):
         result = {}
-        # make unixtime into date and time
-        unix_timestamp = float(self.time)
-        local_timezone = tzlocal.get_localzone()
-        local_time = datetime.fromtimestamp(unix_timestamp, local_timezone)
-        ts_str = local_time.strftime("%Y-%m-%d %H:%M:%S")
-        result["ts"] = ts_str
+        # make unixtime into local date and time (to the second)
+        result["ts"] = local_datetime(int(float(self.time)))
         result["vehicle_id"] = self.vehicle_id
         result["state"] = self.state
         if self.car_locked is not None :
@@ -211,12 +439,8 @@ class tesla_record(object):
         if self.heading is not None :
 	    result["heading"] = self.heading
         if self.gps_as_of is not None :
-            # make gps_as_of unixtime into date and time
-            unix_timestamp = float(self.gps_as_of)
-            local_timezone = tzlocal.get_localzone()
-            local_time = datetime.fromtimestamp(unix_timestamp, local_timezone)
-            gps_str = local_time.strftime("%Y-%m-%d %H:%M:%S")
-            result["gps_as_of"] = gps_str
+            # make gps_as_of unixtime into local date and time
+            result["gps_as_of"] = local_datetime(int(float(self.gps_as_of)))
         if self.charging_state is not None :
 	    result["charging_state"] = self.charging_state
         if self.usable_battery_level is not None :
@@ -248,4 +472,947 @@ class tesla_record(object):
         if self.valet_mode is not None :
 	    result["valet_mode"] = self.valet_mode
         return result
-      
\ No newline at end of file
+
+
+
+class session(object):
+    """One stretch of a vehicle in one mode, as found by session_segmenter
+
+    start and end are unix times.  complete is False when there was no
+    earlier state to compute the deltas from (they are then None).
+    battery_level is the level at the end (percent); level_delta and
+    range_delta (rated miles) are what was gained while Charging and
+    what was used otherwise.  Charging also has energy_added (kW),
+    rate (rated miles per hour), capacity (implied full battery kW) and
+    max_range (implied full rated range); Driving has distance (miles)
+    and efficiency (percent of the rated range used); Standby and
+    Conditioning have rate (rated miles lost per day).
+    """
+
+    __slots__ = ("vehicle_id", "mode", "start", "end", "complete", "battery_level", "level_delta", "range_delta",
+                 "energy_added", "distance", "efficiency", "rate", "capacity", "max_range")
+
+    def __init__(self, vehicle_id, mode, start, end, **fields):
+        for attr in self.__slots__:
+            setattr(self, attr, fields.get(attr))
+        self.vehicle_id = vehicle_id
+        self.mode = mode
+        self.start = start
+        self.end = end
+        self.complete = fields.get("complete", True)
+
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+    def __repr__(self):
+        return "session(%s)"%", ".join(["%s=%r"%(attr, getattr(self, attr)) for attr in self.__slots__])
+
+
+    def sql_session_insert_dict(self):
+        """Return the table (see SESSION_TABLES) and a dictionary of column values to insert, or (None, None)"""
+
+        table = SESSION_TABLES.get(self.mode)
+        if table is None:
+            return None, None
+        result = {}
+        result["vehicle_id"] = self.vehicle_id
+        # the same local time as vehicle_status ts
+        result["start_ts"] = local_datetime(int(float(self.start)))
+        result["end_ts"] = local_datetime(int(float(self.end)))
+        if table == "idle_session":
+            result["mode"] = self.mode
+        if self.complete:
+            result["battery_level"] = self.battery_level
+            if table == "charge_session":
+                result["level_added"] = self.level_delta
+                result["range_added"] = self.range_delta
+                result["energy_added"] = self.energy_added
+                result["rate"] = self.rate
+                result["capacity"] = self.capacity
+                result["max_range"] = self.max_range
+            else:
+                result["level_used"] = self.level_delta
+                result["range_used"] = self.range_delta
+                if table == "drive_session":
+                    result["distance"] = self.distance
+                    result["efficiency"] = self.efficiency
+                else:
+                    result["rate"] = self.rate
+        return table, result
+
+
+
+class _segment_state(object):
+    """Summary state of one vehicle in session_segmenter"""
+
+    __slots__ = ("first", "lastprev", "save", "last", "polled_time", "time")
+
+    def __init__(self):
+        for attr in self.__slots__:
+            setattr(self, attr, None)
+
+
+
+class session_segmenter(object):
+    """Split the records of any number of vehicles into sessions (see session)
+
+    Feed the records in time order; each vehicle keeps only a few
+    records of state.  Records are merged as they arrive (fields
+    missing from a record keep their previous values), and a session
+    ends when a record has a different mode, other than Polling.  A
+    session leaving Driving waits for a record with an odometer.
+
+    The state of a vehicle can be saved (as a dictionary which json can
+    encode) with get_state() and restored with set_state(), to carry on
+    in a later run.  Only the fields sessions are computed from
+    (STATE_FIELDS) are kept.
+    """
+
+    STATE_FIELDS = ("time", "mode", "odometer", "battery_range", "usable_battery_level", "charge_energy_added")
+    STATE_RECORDS = ("first", "lastprev", "save", "last")
+
+    def __init__(self):
+        self.vehicles = {}
+        self.polled_time = None
+
+
+    def feed(self, this):
+        """Add a record, returning the session it ended, if any
+
+        polled_time is then the time of the last Polling record before
+        a mode change (tesla-parser.py shows this record at that time),
+        or None.
+        """
+
+        self.polled_time = None
+        state = self.vehicles.get(this.vehicle_id)
+        if state is None:
+            state = self.vehicles[this.vehicle_id] = _segment_state()
+        state.time = this.time
+
+        if this.mode == "Polling":
+            state.polled_time = this.time
+            return None
+
+        state.save = state.save + this if state.save else this
+        save = state.save
+        result = None
+
+        if state.first is None:
+            state.polled_time = None
+            state.first = save
+            state.lastprev = save
+        elif state.first.mode != this.mode:
+            if state.polled_time:
+                self.polled_time = state.polled_time
+                state.polled_time = None
+
+            if state.first.mode == "Driving" and not this.odometer:
+                state.last = save
+                return None
+
+            result = self._session(this.vehicle_id, state.first, state.lastprev, state.last, save, this)
+            state.first = save
+            state.lastprev = state.last
+
+        state.last = save
+        return result
+
+
+    def get_state(self, vehicle_id):
+        """The state of a vehicle (None if unknown)"""
+
+        state = self.vehicles.get(vehicle_id)
+        if state is None:
+            return None
+        result = {"polled_time": state.polled_time, "time": state.time}
+        for attr in self.STATE_RECORDS:
+            record = getattr(state, attr)
+            result[attr] = dict([(field, getattr(record, field)) for field in self.STATE_FIELDS]) if record is not None else None
+        return result
+
+
+    def set_state(self, vehicle_id, saved):
+        """Restore the state of a vehicle from get_state()"""
+
+        state = _segment_state()
+        state.polled_time = saved.get("polled_time")
+        state.time = saved.get("time")
+        for attr in self.STATE_RECORDS:
+            fields = saved.get(attr)
+            if fields is not None:
+                record = tesla_record()
+                for field in self.STATE_FIELDS:
+                    setattr(record, field, fields.get(field))
+                setattr(state, attr, record)
+        self.vehicles[vehicle_id] = state
+
+
+    def last_time(self, vehicle_id):
+        """Time of the last record fed for a vehicle, or None"""
+        state = self.vehicles.get(vehicle_id)
+        return state.time if state else None
+
+
+    def _session(self, vehicle_id, first, lastprev, last, save, this):
+        """The session from first to save, given the state before it (lastprev) and the previous record (last)"""
+
+        mode = first.mode
+        duration = save.time - first.time
+        if not lastprev or not lastprev.usable_battery_level or not lastprev.odometer:
+            return session(vehicle_id, mode, first.time, save.time, complete=False)
+
+        if mode == "Charging":
+            battery_range = save.battery_range if save.battery_range > last.battery_range else last.battery_range
+            battery_level = save.usable_battery_level if save.usable_battery_level > last.usable_battery_level else last.usable_battery_level
+            level_delta = battery_level - lastprev.usable_battery_level
+            range_delta = battery_range - lastprev.battery_range
+            return session(vehicle_id, mode, first.time, save.time,
+                           battery_level=battery_level, level_delta=level_delta, range_delta=range_delta,
+                           energy_added=save.charge_energy_added,
+                           rate=range_delta * 3600.0 / duration if duration else None,
+                           capacity=(save.charge_energy_added * 100.0 / level_delta) if level_delta > 0 else -0,
+                           max_range=battery_range * 100.0 / save.usable_battery_level if save.usable_battery_level else None)
+
+        if mode == "Driving":
+            battery_range = save.battery_range if save.battery_range < last.battery_range else last.battery_range
+            battery_level = save.usable_battery_level if save.usable_battery_level < last.usable_battery_level else last.usable_battery_level
+            distance = save.odometer - lastprev.odometer
+            range_delta = lastprev.battery_range - battery_range
+            return session(vehicle_id, mode, first.time, save.time,
+                           battery_level=battery_level, level_delta=lastprev.usable_battery_level - battery_level,
+                           range_delta=range_delta, distance=distance,
+                           efficiency=distance * 100.0 / range_delta if range_delta > 0 else -0)
+
+        if mode in ("Standby", "Conditioning"):
+            battery_range = save.battery_range if save.battery_range < last.battery_range else last.battery_range
+            battery_level = last.usable_battery_level
+            range_delta = lastprev.battery_range - battery_range
+            return session(vehicle_id, mode, first.time, save.time,
+                           battery_level=battery_level, level_delta=lastprev.usable_battery_level - battery_level,
+                           range_delta=range_delta, rate=range_delta / (duration / 86400.0) if duration else None)
+
+        return session(vehicle_id, mode, first.time, save.time)
+      
+
+
+# inotify(7) event mask for changes to files in a watched directory
+_IN_WATCH = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 # MODIFY ATTRIB CLOSE_WRITE MOVED_FROM MOVED_TO CREATE DELETE
+_IN_NONBLOCK_CLOEXEC = os.O_NONBLOCK | 0o2000000
+
+
+
+class tail_follower(object):
+    """Follow a file as it grows, like tail -F, without a subprocess
+
+    Handles the file (or the symlink pointing at it, such as the
+    cur.json written by tesla_poller) being replaced, and the file being
+    truncated.  Uses inotify to wake up when a directory changes if it
+    is available, otherwise polls every interval seconds.  readline()
+    blocks until a complete line is available, calling idle (if given)
+    each time it has to wait.
+    """
+
+    def __init__(self, path, numlines=10, interval=1.0, chunksize=65536, idle=None):
+        """Start following path, beginning with its last numlines lines"""
+
+        self.path = path
+        self.interval = interval
+        self.idle = idle
+        self.chunksize = chunksize
+        self.fd = None
+        self.partial = b""
+        self.lines = collections.deque()
+        self._libc = None
+        self._inotify = None
+        self._watching = set()
+
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self._inotify = self._libc.inotify_init1(_IN_NONBLOCK_CLOEXEC)
+            if self._inotify < 0:
+                self._inotify = None
+        except (OSError, AttributeError):
+            self._inotify = None
+
+        while not self._reopen():
+            self._wait()
+        self._seek_last_lines(numlines)
+
+
+    def _watch(self):
+        """Watch the directories holding the path and whatever it points to"""
+
+        if self._inotify is None:
+            return
+        for name in (self.path, os.path.realpath(self.path)):
+            dirname = os.path.dirname(os.path.abspath(name))
+            if dirname not in self._watching:
+                if self._libc.inotify_add_watch(self._inotify, dirname.encode("utf-8"), _IN_WATCH) >= 0:
+                    self._watching.add(dirname)
+
+
+    def _reopen(self):
+        """Open path (again), returning False if it does not exist right now"""
+
+        try:
+            fd = open(self.path, "rb")
+        except IOError:
+            return False
+        if self.fd is not None:
+            self.fd.close()
+        self.fd = fd
+        self.partial = b""
+        self._watch()
+        return True
+
+
+    def _seek_last_lines(self, numlines):
+        """Position the file so the next read returns its last numlines lines"""
+
+        self.fd.seek(0, os.SEEK_END)
+        pos = end = self.fd.tell()
+        if numlines <= 0:
+            return
+
+        # A final line without a newline counts as a line, like tail
+        newlines = 0
+        while pos > 0:
+            step = min(self.chunksize, pos)
+            pos -= step
+            self.fd.seek(pos)
+            chunk = self.fd.read(step)
+            if pos + step == end and chunk.endswith(b"\n"):
+                chunk = chunk[:-1]
+            idx = len(chunk)
+            while True:
+                idx = chunk.rfind(b"\n", 0, idx)
+                if idx < 0:
+                    break
+                newlines += 1
+                if newlines == numlines:
+                    self.fd.seek(pos + idx + 1)
+                    return
+        self.fd.seek(0)
+
+
+    def _replaced(self):
+        """Has path been pointed at a different file than the one we have open?"""
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        cur = os.fstat(self.fd.fileno())
+        return (st.st_dev, st.st_ino) != (cur.st_dev, cur.st_ino)
+
+
+    def _wait(self):
+        """Sleep until a watched directory changes, or for interval seconds"""
+
+        if self._inotify is None:
+            time.sleep(self.interval)
+            return
+        ready = select.select([self._inotify], [], [], self.interval)[0]
+        if ready:
+            try:
+                os.read(self._inotify, 65536)
+            except OSError:
+                pass
+
+
+    def readline(self):
+        """Return the next complete line, waiting for it if need be"""
+
+        while not self.lines:
+            data = self.fd.read(self.chunksize)
+            if data:
+                data = self.partial + data
+                lines = data.split(b"\n")
+                self.partial = lines.pop()
+                for line in lines:
+                    line += b"\n"
+                    if not isinstance(line, str):
+                        line = line.decode("utf-8")
+                    self.lines.append(line)
+                continue
+
+            # At end of file: has it been replaced or truncated?
+            if self._replaced():
+                if self._reopen():
+                    continue
+            elif os.fstat(self.fd.fileno()).st_size < self.fd.tell():
+                self.fd.seek(0)
+                self.partial = b""
+                continue
+
+            if self.idle:
+                self.idle()
+            self._wait()
+
+        return self.lines.popleft()
+
+
+    def close(self):
+        """Stop following"""
+
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+        if self._inotify is not None:
+            os.close(self._inotify)
+            self._inotify = None
+
+
+
+def _same(a, b):
+    return type(a) is type(b) and a == b
+
+
+
+def _diff(old, new, path, changes, removed):
+    """Fill changes with what is new or different in new, and removed with the paths of keys only in old"""
+
+    for key, value in new.items():
+        if key not in old:
+            changes[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub = {}
+            _diff(old[key], value, path + [key], sub, removed)
+            if sub:
+                changes[key] = sub
+        elif not _same(old[key], value):
+            changes[key] = value
+    for key in old:
+        if key not in new:
+            removed.append(path + [key])
+
+
+
+def _merge(old, changes):
+    """Return a copy of old updated by changes (as made by _diff), sharing what did not change"""
+
+    result = dict(old)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+
+def _remove(old, path):
+    """Return a copy of old without the key at path"""
+
+    result = dict(old)
+    if len(path) == 1:
+        result.pop(path[0], None)
+    elif isinstance(result.get(path[0]), dict):
+        result[path[0]] = _remove(result[path[0]], path[1:])
+    return result
+
+
+
+class delta_encoder(object):
+    """Encode tesla_poller json documents as keyframes and deltas
+
+    The first document of each vehicle (by "id"), and then one every
+    keyframe_interval seconds, is written in full.  The others are
+    written as {"delta": 1, "id", "vehicle_id", "retrevial_time",
+    "set": {changed or new values, nested like the document}, "unset":
+    [paths of removed keys]} against the previous document of the
+    vehicle.  Call reset() when starting a new file, so every file can
+    be read on its own.
+    """
+
+    def __init__(self, keyframe_interval=3600):
+        self.keyframe_interval = keyframe_interval
+        self.reset()
+
+
+    def reset(self):
+        self.last = {}
+
+
+    def encode(self, vdata):
+        """Return the json text (without newline) for vdata"""
+
+        vid = vdata.get("id")
+        now = vdata.get("retrevial_time")
+        last = self.last.get(vid)
+        if vid is None or now is None or last is None or now - last[1] >= self.keyframe_interval:
+            self.last[vid] = (vdata, now)
+            return json.dumps(vdata)
+
+        changes, removed = {}, []
+        _diff(last[0], vdata, [], changes, removed)
+        changes.pop("retrevial_time", None)
+        self.last[vid] = (vdata, last[1])
+
+        delta = {"delta": 1, "id": vid, "vehicle_id": vdata.get("vehicle_id"), "retrevial_time": now, "set": changes}
+        if removed:
+            delta["unset"] = removed
+        return json.dumps(delta)
+
+
+
+class delta_decoder(object):
+    """Rebuild the full json documents of a file written by delta_encoder
+
+    Documents must be passed to decode() in file order.  Rebuilt
+    documents share unchanged parts with the previous one, so treat
+    them as read only.  rebuilt tells whether the last one was a delta.
+    Callers which set position to the file position of each line before
+    decoding it can ask restart_position() where to resume reading.
+    """
+
+    def __init__(self):
+        self.last = {}
+        self.rebuilt = False
+        self.position = None
+        self.keyframes = {}
+        self.dependent = set()
+
+
+    def decode(self, jline):
+        """Return the full document for jline, or None for a delta without its keyframe"""
+
+        self.rebuilt = "delta" in jline
+        if not self.rebuilt:
+            if "id" in jline and "retrevial_time" in jline:
+                self.last[jline["id"]] = jline
+                self.keyframes[jline["id"]] = self.position
+                self.dependent.discard(jline["id"])
+            return jline
+
+        self.dependent.add(jline.get("id"))
+        last = self.last.get(jline.get("id"))
+        if last is None:
+            return None
+        result = _merge(last, jline.get("set", {}))
+        for path in jline.get("unset", ()):
+            result = _remove(result, path)
+        result["retrevial_time"] = jline["retrevial_time"]
+        self.last[jline["id"]] = result
+        return result
+
+
+    def restart_position(self, position):
+        """Where to start reading (at most position) to decode the lines after position"""
+
+        keyframes = [self.keyframes[vid] for vid in self.dependent if self.keyframes.get(vid) is not None]
+        return min([position] + keyframes)
+
+
+
+# Fields the log indexes are built from, found without decoding the json
+_INDEX_VEHICLE = re.compile(r'"vehicle_id":\s*(\d+)')
+_INDEX_TIME = re.compile(r'"retrevial_time":\s*(\d+)')
+_INDEX_DELTA = re.compile(r'"delta":\s*1[,}]')
+
+
+
+class _log_reader(object):
+    """Iteration and context manager methods for the log readers below"""
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+    def close(self):
+        self.fd.close()
+
+
+
+class block_writer(object):
+    """Write log lines as independently zlib compressed blocks, with a sidecar index
+
+    A block is sealed once it holds block_size bytes of lines, or on a
+    flush() once its first line is max_age seconds old, or on close().
+    For each block, path.idx gets one json line with the block's offset
+    and length in path, its number of lines, the first and last
+    retrevial_time of each vehicle_id in it and ("continues") the
+    vehicle_ids whose first record in it is a delta (see delta_encoder),
+    which needs the earlier blocks of that vehicle to be rebuilt.
+    """
+
+    def __init__(self, path, block_size=262144, max_age=300, level=6):
+        self.path = path
+        self.block_size = block_size
+        self.max_age = max_age
+        self.level = level
+        self.fd = open(path, "ab")
+        self.fd.seek(0, os.SEEK_END)
+        self.offset = self.fd.tell()
+        self.index = open(path + ".idx", "a")
+        self.pending = ""
+        self._reset()
+
+
+    def _reset(self):
+        self.lines = []
+        self.size = 0
+        self.started = None
+        self.vehicles = {}
+        self.continues = []
+
+
+    def write(self, data):
+        """Add data (complete lines are indexed, a partial one waits for the rest)"""
+
+        lines = (self.pending + data).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self._add(line + "\n")
+
+
+    def _add(self, line):
+        if self.started is None:
+            self.started = time.time()
+        self.lines.append(line)
+        self.size += len(line)
+
+        vehicle = _INDEX_VEHICLE.search(line)
+        when = _INDEX_TIME.search(line)
+        if vehicle and when:
+            when = int(when.group(1))
+            if vehicle.group(1) not in self.vehicles and _INDEX_DELTA.search(line):
+                self.continues.append(vehicle.group(1))
+            span = self.vehicles.setdefault(vehicle.group(1), [when, when])
+            span[0] = min(span[0], when)
+            span[1] = max(span[1], when)
+
+        if self.size >= self.block_size:
+            self._seal()
+
+
+    def _seal(self):
+        """Compress and write the buffered lines as one block, then index it"""
+
+        if not self.lines:
+            return
+        data = "".join(self.lines)
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        block = zlib.compress(data, self.level)
+        self.fd.write(block)
+        self.fd.flush()
+        entry = {"offset": self.offset, "length": len(block), "lines": len(self.lines), "vehicles": self.vehicles}
+        if self.continues:
+            entry["continues"] = self.continues
+        self.index.write(json.dumps(entry, sort_keys=True) + "\n")
+        self.index.flush()
+        self.offset += len(block)
+        self._reset()
+
+
+    def flush(self):
+        """Seal the current block if it has become too old"""
+
+        if self.started is not None and time.time() - self.started >= self.max_age:
+            self._seal()
+
+
+    def fsync(self):
+        os.fsync(self.fd.fileno())
+        os.fsync(self.index.fileno())
+
+
+    def close(self):
+        """Seal everything written so far and close the files"""
+
+        if self.pending:
+            self._add(self.pending + "\n")
+            self.pending = ""
+        self._seal()
+        self.fd.close()
+        self.index.close()
+
+
+
+class block_reader(_log_reader):
+    """Read the lines of a file written by block_writer
+
+    With vehicles (a collection of vehicle_ids) and/or since/until
+    (unix times), only the blocks which the index says may hold such
+    records are decompressed.  Other lines in those blocks are still
+    returned, so callers must filter records themselves.  Blocks needed
+    to rebuild the deltas of those vehicles are read too.  Without an
+    index every block is read, finding where each one ends as it is
+    decompressed.
+
+    Blocks before offset start are skipped.  position is where to start
+    again to get the lines after the last one returned: the offset of
+    its block, or of the next block after the last line of a block.
+    """
+
+    def __init__(self, path, vehicles=None, since=None, until=None, start=0):
+        self.path = path
+        self.fd = open(path, "rb")
+        self.lines = collections.deque()
+        self.blocks = self._select(vehicles, since, until)
+        if self.blocks is not None:
+            self.blocks = collections.deque([block for block in self.blocks if block[0] >= start])
+        self.block = (start, 0)
+        self.decompressed = 0
+
+
+    def _select(self, vehicles, since, until):
+        """Return the (offset, length) of the blocks to read, or None to read everything"""
+
+        try:
+            with open(self.path + ".idx", "r") as R:
+                entries = [json.loads(line) for line in R if line.strip()]
+        except IOError:
+            return None
+
+        if vehicles is not None:
+            vehicles = set([str(v) for v in vehicles])
+
+        if vehicles is None and since is None and until is None:
+            return collections.deque([(entry["offset"], entry["length"]) for entry in entries])
+
+        wanted = set()
+        # Per vehicle, the unread blocks back to one starting with a full record
+        chain = {}
+        for i, entry in enumerate(entries):
+            for vid, (first, last) in entry["vehicles"].items():
+                if vid in entry.get("continues", ()):
+                    chain.setdefault(vid, []).append(i)
+                else:
+                    chain[vid] = [i]
+                if vehicles is not None and vid not in vehicles:
+                    continue
+                if since is not None and last < since:
+                    continue
+                if until is not None and first > until:
+                    continue
+                wanted.update(chain[vid])
+                chain[vid] = []
+
+        return collections.deque([(entries[i]["offset"], entries[i]["length"]) for i in sorted(wanted)])
+
+
+    def _next_block(self):
+        """Decompress the next wanted block into self.lines, returning False at the end"""
+
+        if self.blocks is None:
+            # No index, the block after the last one, which ends where zlib says it does
+            offset = self.block[0] + self.block[1]
+            self.fd.seek(offset)
+            d = zlib.decompressobj()
+            data = []
+            read = 0
+            while not d.unused_data:
+                chunk = self.fd.read(65536)
+                if not chunk:
+                    break
+                try:
+                    data.append(d.decompress(chunk))
+                except zlib.error:
+                    raise ValueError("%s: no compressed block at offset %d" % (self.path, offset))
+                read += len(chunk)
+            if not read:
+                return False
+            self.block = (offset, read - len(d.unused_data))
+            self._add_lines(b"".join(data))
+            return True
+
+        if not self.blocks:
+            return False
+        offset, length = self.block = self.blocks.popleft()
+        self.fd.seek(offset)
+        self._add_lines(zlib.decompress(self.fd.read(length)))
+        return True
+
+
+    def _add_lines(self, data):
+        self.decompressed += 1
+        if not isinstance(data, str):
+            data = data.decode("utf-8")
+        self.lines.extend(data.splitlines(True))
+
+
+    def readline(self):
+        """Return the next line, or "" at the end"""
+
+        while not self.lines:
+            if not self._next_block():
+                return ""
+        return self.lines.popleft()
+
+
+    @property
+    def position(self):
+        if self.lines:
+            return self.block[0]
+        return self.block[0] + self.block[1]
+
+
+
+def update_index(path, bucket=3600, save=False):
+    """Bring the time index of a plain tesla_poller log up to date, returning it
+
+    The index (read from path.tidx if there is one, and written back
+    there only with save) records, for each
+    vehicle_id and each bucket seconds of retrevial_time, the byte
+    offsets of the first line and of the end of the last line, and
+    where to start reading to rebuild the first one if it is a delta
+    (see delta_encoder).  Only the part of the file added since the
+    last update is scanned, and only with regular expressions.
+    """
+
+    st = os.stat(path)
+    iname = path + ".tidx"
+    index = None
+    try:
+        with open(iname, "r") as R:
+            index = json.load(R)
+    except (IOError, ValueError):
+        pass
+
+    if not index or index["inode"] != st.st_ino or index["size"] > st.st_size or index["bucket"] != bucket:
+        index = {"inode": st.st_ino, "size": 0, "bucket": bucket, "keyframes": {}, "buckets": {}}
+    if index["size"] == st.st_size:
+        return index
+
+    keyframes = index["keyframes"]
+    buckets = index["buckets"]
+    offset = index["size"]
+    with open(path, "rb") as R:
+        R.seek(offset)
+        for line in R:
+            if not line.endswith(b"\n"):
+                # Partial last line, wait for the rest
+                break
+            end = offset + len(line)
+            if not isinstance(line, str):
+                line = line.decode("utf-8")
+
+            vehicle = _INDEX_VEHICLE.search(line)
+            when = _INDEX_TIME.search(line)
+            if vehicle and when:
+                vid = vehicle.group(1)
+                when = int(when.group(1))
+                delta = _INDEX_DELTA.search(line)
+                if not delta:
+                    keyframes[vid] = offset
+                key = str(when - when % bucket)
+                entry = buckets.setdefault(vid, {}).get(key)
+                if entry is None:
+                    buckets[vid][key] = [offset, end, keyframes.get(vid, offset) if delta else offset]
+                else:
+                    entry[1] = end
+            offset = end
+    index["size"] = offset
+
+    if not save:
+        return index
+    try:
+        tmpname = "%s.%d"%(iname, os.getpid())
+        with open(tmpname, "w") as W:
+            json.dump(index, W)
+        os.rename(tmpname, iname)
+    except (IOError, OSError):
+        pass
+    return index
+
+
+
+def index_ranges(index, vehicles=None, since=None, until=None):
+    """Return the sorted, merged (start, end) byte ranges of an update_index index to read for these records"""
+
+    if vehicles is not None:
+        vehicles = set([str(v) for v in vehicles])
+    bucket = index["bucket"]
+
+    ranges = []
+    for vid, entries in index["buckets"].items():
+        if vehicles is not None and vid not in vehicles:
+            continue
+        for key, (first, end, start) in entries.items():
+            if since is not None and int(key) + bucket <= since:
+                continue
+            if until is not None and int(key) > until:
+                continue
+            ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+
+class indexed_reader(_log_reader):
+    """Read only the lines of a plain tesla_poller log which may be records of vehicles between since and until
+
+    Uses update_index to find them.  Other lines in the ranges read are
+    still returned, so callers must filter records themselves.
+    """
+
+    def __init__(self, path, vehicles=None, since=None, until=None):
+        self.path = path
+        self.fd = open(path, "rb")
+        self.ranges = collections.deque(index_ranges(update_index(path), vehicles=vehicles, since=since, until=until))
+        self.pos = 0
+        self.end = 0
+
+
+    def readline(self):
+        """Return the next line, or "" at the end"""
+
+        while self.pos >= self.end:
+            if not self.ranges:
+                return ""
+            start, self.end = self.ranges.popleft()
+            if start != self.pos:
+                self.fd.seek(start)
+            self.pos = start
+
+        line = self.fd.readline()
+        if not line:
+            self.ranges.clear()
+            return ""
+        self.pos += len(line)
+        if not isinstance(line, str):
+            line = line.decode("utf-8")
+        return line
+
+
+
+def open_log(path, vehicles=None, since=None, until=None, start=0):
+    """Open a tesla_poller log, either plain json lines or blocks (.jsonz) from block_writer
+
+    With vehicles (vehicle_ids), since or until (unix times), only the
+    parts of the file which may hold those records are read.  Otherwise
+    reading starts at offset start (a position of block_reader for .jsonz).
+    """
+
+    if path.endswith(".jsonz"):
+        return block_reader(path, vehicles=vehicles, since=since, until=until, start=start)
+    if vehicles is not None or since is not None or until is not None:
+        return indexed_reader(path, vehicles=vehicles, since=since, until=until)
+    fd = open(path, "r")
+    if start:
+        fd.seek(start)
+    return fd
@@ -16,91 +16,350 @@ v.command('charge_start')
 """
 
 try: # Python 3
-    from urllib.parse import urlencode
+    from urllib.parse import urlencode, urlsplit
     from urllib.request import Request, build_opener
     from urllib.request import ProxyHandler, HTTPBasicAuthHandler, HTTPHandler, HTTPSHandler, HTTPError, URLError
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException, BadStatusLine
 except: # Python 2
     from urllib import urlencode
+    from urlparse import urlsplit
     from urllib2 import Request, build_opener
     from urllib2 import ProxyHandler, HTTPBasicAuthHandler, HTTPHandler, HTTPSHandler, HTTPError, URLError
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException, BadStatusLine
+import email.utils
+import io
 import json
+import socket
+import threading
 import time
 import warnings
 
 
 
-class Connection(object):
-    """Connection to Tesla Motors API"""
+class ConnectionPool(object):
+    """Pool of persistent keep-alive HTTP(S) connections
 
-    __version__ = "1.4.0"
+    One pool is normally owned by a Connection and shared by all of
+    its Vehicle objects, but a pool may also be handed to several
+    Connection objects (e.g. one per account) to share sockets.
+    """
 
-    def __init__(self,
-                 email='',
-                 password='',
-                 access_token='',
-                 tokens_file='',
-                 proxy_url = '',
-                 proxy_user = '',
-                 proxy_password = '',
-                 retries = 0,
-                 retry_delay = 1.5,
-                 tesla_client = None,
-                 debug = False):
-        """Initialize connection object
+    def __init__(self, maxsize=4, idle_timeout=60, timeout=None, debuglevel=0):
+        """Initialize connection pool
 
-        Sets the vehicles field, a list of Vehicle objects
-        associated with your account
+        maxsize: Maximum number of idle connections kept per host
+        idle_timeout: Seconds an idle connection may be kept before being discarded
+        timeout: Socket timeout for new connections (None for system default)
+        debuglevel: http.client debug level for new connections
+        """
 
-        Required parameters:
-          Option 1: (will log in and get tokens using credentials)
-            email: your login for teslamotors.com
-            password: your password for teslamotors.com
-          Option 2: (will use tokens directly and refresh tokens as needed)
-            tokens_file: File containing json tokens data, will update after refresh
-          Option 3: (use use specified token until it is invalid>
-            access_token
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.debuglevel = debuglevel
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+
+
+    def _checkout(self, key):
+        """Get an idle connection for (scheme, host, port), or make a new one"""
+
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if last_used + self.idle_timeout > now:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+            self.created += 1
+
+        scheme, host, port = key
+        if scheme == "https":
+            conn = HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = HTTPConnection(host, port, timeout=self.timeout)
+        conn.set_debuglevel(self.debuglevel)
+        return conn, False
 
-          If you combine option 1&2, it will populate the tokens file
 
 
-        Optional parameters:
-        proxy_url: URL for proxy server
-        proxy_user: username for proxy server
-        proxy_password: password for proxy server
-        retries: Number of times we will retry command on HTTP failure beforing failing
-        retry_delay: Time in seconds we will multiplicatively back off after each failure
-        debug: Turn on debugging of web traffic to tesla (non-proxy case)
+    def _checkin(self, key, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+
+
+    def clear(self):
+        """Close all idle connections"""
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, last_used in conns:
+                conn.close()
+
+
+
+    def request(self, method, url, headers={}, body=None):
+        """Perform a request, returning (status, headers, body bytes)
+
+        Raises HTTPError for HTTP error statuses and URLError for
+        connection failures, like urlopen does.
+        """
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            conn, reused = self._checkout(key)
+            sent = False
+            try:
+                conn.request(method, path, body, headers)
+                sent = True
+                resp = conn.getresponse()
+                data = resp.read()
+            except (HTTPException, socket.error) as e:
+                conn.close()
+                # The server may have silently dropped an idle connection, try a fresh one
+                # unless the request may have reached it (it could be a command)
+                if reused and (_not_answered(e) if sent else not isinstance(e, socket.timeout)):
+                    continue
+                raise URLError(e)
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, resp.reason, resp.msg, io.BytesIO(data))
+
+        return resp.status, resp.msg, data
+
+
+
+def _not_answered(e):
+    """Whether e says the server closed the connection instead of sending a status line"""
+
+    # RemoteDisconnected on Python 3
+    if isinstance(e, BadStatusLine) and isinstance(e, socket.error):
+        return True
+    if not isinstance(e, BadStatusLine):
+        return False
+    # Python 2 raises BadStatusLine("") (or "''") for a connection closed without a reply
+    return getattr(e, "line", None) in ("", "''") or str(e).startswith("No status line received")
+
+
+
+
+class RateLimiter(object):
+    """Token bucket limiting the rate of API requests
+
+    Shared by all requests of a Connection (and optionally by several
+    Connection objects on the same account).  Also honors server
+    Retry-After hints by holding every request until they expire.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        """Initialize rate limiter
+
+        rate: Sustained requests per second (None for no limit)
+        burst: Number of requests which may be made back to back
         """
 
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+        self.blocked_until = 0
+        self.requests = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+
+
+    def reserve(self):
+        """Take a token, returning the seconds the caller must wait before using it"""
+
+        with self._lock:
+            now = time.time()
+            wait = max(0, self.blocked_until - now)
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + max(0, now - self.stamp) * self.rate)
+                self.stamp = max(now, self.stamp)
+                self.tokens -= 1
+                if self.tokens < 0:
+                    # Tokens are counted at stamp, which a defer() may have put in the future
+                    wait = max(wait, (self.stamp - now) - self.tokens / self.rate)
+
+            self.requests += 1
+            if wait > 0:
+                self.waits += 1
+                self.wait_time += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+
+
+    def acquire(self):
+        """Block until a request may be made, returning the time waited"""
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+
+    def defer(self, seconds):
+        """Make no requests for the next seconds (e.g. from a Retry-After header)"""
+
+        with self._lock:
+            until = time.time() + seconds
+            self.blocked_until = max(self.blocked_until, until)
+            if until > self.stamp:
+                # Count tokens from the end of the hold: one request may go then
+                # (after any already queued past it), the rest follow at the sustained rate
+                if self.rate:
+                    self.tokens = min(1, self.tokens + (until - self.stamp) * self.rate)
+                self.stamp = until
+
+
+
+def _retry_after(e):
+    """Seconds the server asked us to wait in a 429/503 HTTPError, or None"""
+
+    if not isinstance(e, HTTPError) or e.code not in (429, 503) or not e.headers:
+        return None
+    hint = e.headers.get("Retry-After")
+    if not hint:
+        return None
+    try:
+        return max(0, float(hint))
+    except ValueError:
+        date = email.utils.parsedate_tz(hint)
+        if date is None:
+            return None
+        return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+
+
+class BaseConnection(object):
+    """State and policy shared by the blocking and asyncio connections
+
+    Holds the authentication tokens, the retry policy and the API
+    client description (with base URL validation).  Subclasses supply
+    the transport.
+    """
+
+    __version__ = "1.4.0"
+
+    def _configure(self,
+                   email='',
+                   password='',
+                   access_token='',
+                   tokens_file='',
+                   retries = 0,
+                   retry_delay = 1.5,
+                   limiter = None,
+                   rate_limit = None,
+                   rate_burst = 5,
+                   validate_baseurl = True,
+                   debug = False):
+        """Initialize authentication, retry and rate limit settings"""
+
         self.tries = retries + 1
         self.retry_delay = retry_delay
-        self.proxy_url = proxy_url
-        self.proxy_user = proxy_user
-        self.proxy_password = proxy_password
         self.debug = debug
+        self.validate_baseurl = validate_baseurl
         self.debuglevel = 1 if debug else 0
         self.head = {}
         self.tokens_file = tokens_file
         self.access_token = access_token
         self.refresh_token = None
+        self.email = email
+        self.password = password
+        self.limiter = limiter or RateLimiter(rate=rate_limit, burst=rate_burst)
+        self.bytes_received = 0
+        self._thread_bytes = threading.local()
+        self.calls = {}
+        self.errors = 0
+        self.retry_count = 0
+        self._stats_lock = threading.Lock()
+
+
+
+    def _count(self, payload):
+        """Account for the bytes of a response body"""
+
+        with self._stats_lock:
+            self.bytes_received += len(payload)
+        self._thread_bytes.count = self.thread_bytes_received() + len(payload)
+
+
+
+    def thread_bytes_received(self):
+        """Bytes of response bodies received so far by requests made from the calling thread"""
+        return getattr(self._thread_bytes, "count", 0)
 
-        # Obtain URL and program access tokens from pastebin if not on CLI
-        if not tesla_client:
-            tesla_client = self.__open("/raw/0a8e0xTJ", baseurl="http://pastebin.com")
+
+
+    def call_counts(self):
+        """A copy of calls, safe to use while other threads make requests"""
+        with self._stats_lock:
+            return dict(self.calls)
+
+
+
+    def _count_call(self, url):
+        """Account for a request to url, by endpoint (url without the API prefix and vehicle id)"""
+
+        api = getattr(self, "api", None)
+        if api and url.startswith(api):
+            url = url[len(api):]
+        words = url.strip("/").split("/")
+        if words[0] == "vehicles" and len(words) > 1:
+            words = words[2:] or ["vehicle"]
+        endpoint = "/".join(words)
+        with self._stats_lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+
+
+    def _set_client(self, tesla_client):
+        """Set (and validate) the API client description from pastebin or the CLI"""
 
         self.current_client = tesla_client['v1']
 
         # Validate that returned URL is going to tesla, to prevent MITM attack
         self.baseurl = self.current_client['baseurl']
         prefix='https://'
-        if not self.baseurl.startswith(prefix) or '/' in self.baseurl[len(prefix):] or not self.baseurl.endswith(('.teslamotors.com','.tesla.com')):
+        if self.validate_baseurl and (not self.baseurl.startswith(prefix) or '/' in self.baseurl[len(prefix):] or not self.baseurl.endswith(('.teslamotors.com','.tesla.com'))):
             raise IOError("Unexpected URL (%s) from pastebin" % self.baseurl)
 
         # Prefix for API queries
         self.api = self.current_client['api']
 
-        if access_token:
-            self._sethead(access_token)
+        if self.access_token:
+            self._sethead(self.access_token)
         else:
             self.expiration = 0 # force refresh
 
@@ -108,8 +367,8 @@ class Connection(object):
                 "grant_type" : "password",
                 "client_id" : self.current_client['id'],
                 "client_secret" : self.current_client['secret'],
-                "email" : email,
-                "password" : password }
+                "email" : self.email,
+                "password" : self.password }
 
         if self.tokens_file:
             try:
@@ -118,22 +377,6 @@ class Connection(object):
             except IOError as e:
                 warnings.warn("Could not open file %s: %s (pressing on in hopes of alternate authenticaiton)"%(self.tokens_file, str(e)))
 
-        self.vehicles = [Vehicle(v, self) for v in sorted(self.get('vehicles')['response'], key=lambda d: d['id'])]
-
-
-
-    def get(self, command):
-        """Utility command to get data from API"""
-        return self.post(command, None)
-
-
-
-    def post(self, command, data={}):
-        """Utility command to post data to API"""
-        if time.time() > self.expiration:
-            self._refresh_token()
-        return self.__open("%s%s" % (self.api, command), headers=self.head, data=data)
-
 
 
     def _user_agent(self):
@@ -165,8 +408,17 @@ class Connection(object):
 
 
 
-    def _refresh_token(self):
-        """Refresh tokens using either (preset) email/password or refresh_token"""
+    def _token_expired(self):
+        """Do we need to refresh our access token before the next request?"""
+        return time.time() > self.expiration
+
+
+
+    def _refresh_request(self):
+        """Prepare to refresh tokens using either (preset) email/password or refresh_token
+
+        Returns the oauth form data to post to /oauth/token
+        """
 
         if self.refresh_token:
             self.oauth = {
@@ -176,7 +428,13 @@ class Connection(object):
                 "refresh_token" : self.refresh_token }
 
         self.head = {}
-        tokens = self.__open("/oauth/token", data=self.oauth)
+        return self.oauth
+
+
+
+    def _refresh_response(self, tokens):
+        """Install tokens returned by /oauth/token, saving them if requested"""
+
         self._update_tokens(tokens=tokens)
         if self.tokens_file:
             with open(self.tokens_file, "w") as W:
@@ -184,54 +442,187 @@ class Connection(object):
 
 
 
+    def _encode(self, headers, data):
+        """Return (headers, body) for a request with optional form data"""
+
+        self._user_agent()
+        if data is None:
+            return headers, None
+        headers = dict(headers)
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        return headers, urlencode(data).encode('utf-8')
+
+
+
+    def _retry_wait(self, count, e):
+        """Return seconds to wait after failed try number count, or raise e if out of tries"""
+
+        if self.debug:
+            print('# %d Timed out or other error for %s: %s\n'%(time.time(),type,str(e)))
+
+        with self._stats_lock:
+            self.errors += 1
+
+        # Throttled: hold back every request on this limiter, not just this one
+        hint = _retry_after(e)
+        if hint is not None:
+            self.limiter.defer(hint)
+
+        count += 1
+        if count >= self.tries:
+            raise e
+        with self._stats_lock:
+            self.retry_count += 1
+        return count * self.retry_delay
+
+
+
+
+class Connection(BaseConnection):
+    """Connection to Tesla Motors API"""
+
+    def __init__(self,
+                 email='',
+                 password='',
+                 access_token='',
+                 tokens_file='',
+                 proxy_url = '',
+                 proxy_user = '',
+                 proxy_password = '',
+                 retries = 0,
+                 retry_delay = 1.5,
+                 tesla_client = None,
+                 pool = None,
+                 pool_size = 4,
+                 pool_idle_timeout = 60,
+                 limiter = None,
+                 rate_limit = None,
+                 rate_burst = 5,
+                 validate_baseurl = True,
+                 debug = False):
+        """Initialize connection object
+
+        Sets the vehicles field, a list of Vehicle objects
+        associated with your account
+
+        Required parameters:
+          Option 1: (will log in and get tokens using credentials)
+            email: your login for teslamotors.com
+            password: your password for teslamotors.com
+          Option 2: (will use tokens directly and refresh tokens as needed)
+            tokens_file: File containing json tokens data, will update after refresh
+          Option 3: (use use specified token until it is invalid>
+            access_token
+
+          If you combine option 1&2, it will populate the tokens file
+
+
+        Optional parameters:
+        proxy_url: URL for proxy server
+        proxy_user: username for proxy server
+        proxy_password: password for proxy server
+        retries: Number of times we will retry command on HTTP failure beforing failing
+        retry_delay: Time in seconds we will multiplicatively back off after each failure
+        pool: ConnectionPool to share with other Connection objects (non-proxy case)
+        pool_size: Maximum idle keep-alive connections per host if we create our own pool
+        pool_idle_timeout: Seconds an idle keep-alive connection is kept if we create our own pool
+        limiter: RateLimiter to share with other Connection objects on the same account
+        rate_limit: Sustained API requests per second if we create our own limiter (None for no limit)
+        rate_burst: API requests which may be made back to back if we create our own limiter
+        validate_baseurl: Refuse API base URLs which are not https on a Tesla domain (False for test servers)
+        debug: Turn on debugging of web traffic to tesla (non-proxy case)
+        """
+
+        self._configure(email=email, password=password, access_token=access_token, tokens_file=tokens_file,
+                        retries=retries, retry_delay=retry_delay, limiter=limiter, rate_limit=rate_limit,
+                        rate_burst=rate_burst, validate_baseurl=validate_baseurl, debug=debug)
+        self.proxy_url = proxy_url
+        self.proxy_user = proxy_user
+        self.proxy_password = proxy_password
+        self.pool = pool or ConnectionPool(maxsize=pool_size, idle_timeout=pool_idle_timeout, debuglevel=self.debuglevel)
+        self._opener = None
+
+        # Obtain URL and program access tokens from pastebin if not on CLI
+        if not tesla_client:
+            tesla_client = self.__open("/raw/0a8e0xTJ", baseurl="http://pastebin.com")
+
+        self._set_client(tesla_client)
+
+        self.vehicles = [Vehicle(v, self) for v in sorted(self.get('vehicles')['response'], key=lambda d: d['id'])]
+
+
+
+    def get(self, command):
+        """Utility command to get data from API"""
+        return self.post(command, None)
+
+
+
+    def post(self, command, data={}):
+        """Utility command to post data to API"""
+        if self._token_expired():
+            self._refresh_token()
+        return self.__open("%s%s" % (self.api, command), headers=self.head, data=data)
+
+
+
+    def _refresh_token(self):
+        """Refresh tokens using either (preset) email/password or refresh_token"""
+
+        oauth = self._refresh_request()
+        self._refresh_response(self.__open("/oauth/token", data=oauth))
+
+
+
     def __open(self, url, headers={}, data=None, baseurl=""):
         """Raw urlopen command"""
 
         if not baseurl:
             baseurl = self.baseurl
-        self._user_agent()
+        headers, body = self._encode(headers, data)
 
-
-        last_except = Exception
         for count in range(self.tries):
             try:
-                req = Request("%s%s" % (baseurl, url), headers=headers)
-                try:
-                    req.data = urlencode(data).encode('utf-8') # Python 3
-                except:
-                    try:
-                        req.add_data(urlencode(data)) # Python 2
-                    except:
-                        pass
+                self.limiter.acquire()
+                self._count_call(url)
 
                 # Proxy support
                 if self.proxy_url:
-                    if self.proxy_user:
-                        proxy = ProxyHandler({'https': 'https://%s:%s@%s' % (self.proxy_user,
-                                                                             self.proxy_password,
-                                                                             self.proxy_url)})
-                        auth = HTTPBasicAuthHandler()
-                        opener = build_opener(proxy, auth, HTTPHandler)
-                    else:
-                        handler = ProxyHandler({'https': self.proxy_url})
-                        opener = build_opener(handler)
+                    payload = self._proxy_open("%s%s" % (baseurl, url), headers, body)
                 else:
-                    opener = build_opener(HTTPSHandler(debuglevel=self.debuglevel))
-
-                resp = opener.open(req)
-                charset = resp.info().get('charset', 'utf-8')
+                    status, info, payload = self.pool.request("POST" if body is not None else "GET",
+                                                              "%s%s" % (baseurl, url), headers=headers, body=body)
                 break
             except (HTTPError, URLError) as e:
-                last_except = e
-                if self.debug:
-                    print('# %d Timed out or other error for %s: %s\n'%(time.time(),type,str(e)))
-                count += 1
-                if count != self.tries:
-                    time.sleep(count * self.retry_delay)
-        else:
-            raise last_except
+                time.sleep(self._retry_wait(count, e))
 
-        return json.loads(resp.read().decode(charset))
+        self._count(payload)
+        return json.loads(payload.decode('utf-8'))
+
+
+
+    def _proxy_open(self, url, headers, body):
+        """Open url through the (lazily built, reused) proxy opener"""
+
+        if self._opener is None:
+            if self.proxy_user:
+                proxy = ProxyHandler({'https': 'https://%s:%s@%s' % (self.proxy_user,
+                                                                     self.proxy_password,
+                                                                     self.proxy_url)})
+                auth = HTTPBasicAuthHandler()
+                self._opener = build_opener(proxy, auth, HTTPHandler)
+            else:
+                handler = ProxyHandler({'https': self.proxy_url})
+                self._opener = build_opener(handler)
+
+        req = Request(url, headers=headers)
+        if body is not None:
+            try:
+                req.data = body # Python 3
+            except:
+                req.add_data(body) # Python 2
+        resp = self._opener.open(req)
+        return resp.read()
 
 
 
@@ -322,7 +713,8 @@ do speed_limit_set_limit limit_mph=65
     parser.add_argument('--proxy_password', default=None, help='Password for optional web proxy')
     parser.add_argument('--retries', default=0, type=int, help='Number of retries on failure')
     parser.add_argument('--retry_delay', default=1.5, type=float, help='Multiplicative backup on failure')
-    parser.add_argument('--tesla_client', default=None, help='Override API retrevial from pastebin')
+    parser.add_argument('--tesla_client', default=None, type=json.loads, help='Override API retrevial from pastebin (json)')
+    parser.add_argument('--no_validate_baseurl', action='store_true', help='Accept any API base URL, such as a local tesla_mockserver.py (not only https on a Tesla domain)')
     parser.add_argument('--debug', default=False, action='store_true', help='Example debugging')
     parser.add_argument('--vid', default=None, help='Vehicle to operate on')
 
@@ -336,7 +728,7 @@ do speed_limit_set_limit limit_mph=65
     if args.command not in ('vehicles', 'get', 'do'):
         raise ValueError('Invalidate command')
 
-    c = Connection(email=args.email, password=args.password, access_token=args.access_token, tokens_file=args.tokens_file, proxy_url=args.proxy_url, proxy_user=args.proxy_user, proxy_password=args.proxy_password, retries=args.retries, retry_delay=args.retry_delay, debug=args.debug)
+    c = Connection(email=args.email, password=args.password, access_token=args.access_token, tokens_file=args.tokens_file, proxy_url=args.proxy_url, proxy_user=args.proxy_user, proxy_password=args.proxy_password, retries=args.retries, retry_delay=args.retry_delay, tesla_client=args.tesla_client, validate_baseurl=not args.no_validate_baseurl, debug=args.debug)
 
     if args.vid is not None:
         try:
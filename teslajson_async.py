@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+""" Asyncio variant of the teslajson Connection and Vehicle classes
+
+Shares token handling, retry policy and base URL validation with
+teslajson.Connection, but performs all HTTP traffic on the running
+event loop so a single thread can poll many vehicles.  Requires
+Python 3.5 or later; proxies are not supported.
+
+Example:
+
+import asyncio
+import teslajson_async
+
+async def main():
+    c = await teslajson_async.AsyncConnection.create(tokens_file='/tmp/tesla.creds')
+    v = c.vehicles[0]
+    await v.wake_up()
+    print(await v.data_request('charge_state'))
+    await v.command('charge_start')
+
+asyncio.get_event_loop().run_until_complete(main())
+"""
+
+import asyncio
+import http.client
+import io
+import json
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from teslajson import BaseConnection, HTTPError, URLError
+
+
+
+class AsyncConnectionPool(object):
+    """Pool of persistent keep-alive HTTP(S) stream connections for one event loop"""
+
+    def __init__(self, maxsize=4, idle_timeout=60, timeout=None, ssl_context=None):
+        """Initialize connection pool
+
+        maxsize: Maximum number of idle connections kept per host
+        idle_timeout: Seconds an idle connection may be kept before being discarded
+        timeout: Seconds allowed for a complete request/response exchange (None for no limit)
+        ssl_context: SSLContext for https connections (default verifies certificates)
+        """
+
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+
+
+
+    async def _checkout(self, key):
+        """Get an idle (reader, writer) for (scheme, host, port), or open a new one"""
+
+        now = time.time()
+        idle = self._idle.get(key, [])
+        while idle:
+            stream, last_used = idle.pop()
+            if last_used + self.idle_timeout > now:
+                self.reused += 1
+                return stream, True
+            stream[1].close()
+        self.created += 1
+
+        scheme, host, port = key
+        if scheme == "https":
+            stream = await asyncio.open_connection(host, port or 443, ssl=self.ssl_context)
+        else:
+            stream = await asyncio.open_connection(host, port or 80)
+        return stream, False
+
+
+
+    def _checkin(self, key, stream):
+        """Return a connection to the pool, closing it if the pool is full"""
+
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.maxsize:
+            idle.append((stream, time.time()))
+        else:
+            stream[1].close()
+
+
+
+    def clear(self):
+        """Close all idle connections"""
+
+        idle, self._idle = self._idle, {}
+        for streams in idle.values():
+            for stream, last_used in streams:
+                stream[1].close()
+
+
+
+    async def _send(self, stream, method, host, path, headers, body):
+        """Send one request"""
+
+        reader, writer = stream
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % host]
+        lines += ["%s: %s" % (k, v) for k, v in headers.items()]
+        if body is not None:
+            lines.append("Content-Length: %d" % len(body))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+
+
+    async def _receive(self, stream, method):
+        """Read the response to a request sent, returning (status, reason, headers, body, will_close)"""
+
+        reader, writer = stream
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                # Closed without answering, as http.client reports it
+                raise http.client.RemoteDisconnected("Remote end closed connection without response")
+            raise
+        statusline, rest = head.split(b"\r\n", 1)
+        version, status, reason = (statusline.decode('latin-1').split(" ", 2) + [""])[:3]
+        status = int(status)
+        info = http.client.parse_headers(io.BytesIO(rest))
+
+        connection = info.get("Connection", "").lower()
+        will_close = connection == "close" or (version == "HTTP/1.0" and connection != "keep-alive")
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            data = b""
+        elif info.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if not size:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            # Skip any trailers
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            data = b"".join(chunks)
+        elif info.get("Content-Length") is not None:
+            data = await reader.readexactly(int(info["Content-Length"]))
+        else:
+            data = await reader.read()
+            will_close = True
+
+        return status, reason, info, data, will_close
+
+
+
+    async def request(self, method, url, headers={}, body=None):
+        """Perform a request, returning (status, headers, body bytes)
+
+        Raises HTTPError for HTTP error statuses and URLError for
+        connection failures, like teslajson.ConnectionPool.request.
+        """
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            stream, reused, sent = None, False, False
+            try:
+                stream, reused = await self._checkout(key)
+                deadline = None if self.timeout is None else time.time() + self.timeout
+                await asyncio.wait_for(self._send(stream, method, parts.netloc, path, headers, body), self.timeout)
+                sent = True
+                remaining = None if deadline is None else max(0, deadline - time.time())
+                status, reason, info, data, will_close = await asyncio.wait_for(self._receive(stream, method), remaining)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError) as e:
+                if stream:
+                    stream[1].close()
+                # The server may have silently dropped an idle connection, try a fresh one
+                # unless the request may have reached it (it could be a command)
+                if reused and (isinstance(e, http.client.RemoteDisconnected) if sent else not isinstance(e, asyncio.TimeoutError)):
+                    continue
+                raise URLError(e)
+            break
+
+        if will_close:
+            stream[1].close()
+        else:
+            self._checkin(key, stream)
+
+        if status >= 400:
+            raise HTTPError(url, status, reason, info, io.BytesIO(data))
+
+        return status, info, data
+
+
+
+
+class AsyncConnection(BaseConnection):
+    """Asyncio connection to Tesla Motors API
+
+    Construct with the same authentication and retry parameters as
+    teslajson.Connection (except the proxy ones), then await
+    connect() -- or use the create() coroutine which does both.
+    """
+
+    def __init__(self,
+                 email='',
+                 password='',
+                 access_token='',
+                 tokens_file='',
+                 retries = 0,
+                 retry_delay = 1.5,
+                 tesla_client = None,
+                 pool = None,
+                 pool_size = 4,
+                 pool_idle_timeout = 60,
+                 limiter = None,
+                 rate_limit = None,
+                 rate_burst = 5,
+                 validate_baseurl = True,
+                 debug = False):
+        """Initialize connection object (no network traffic until connect)"""
+
+        self._configure(email=email, password=password, access_token=access_token, tokens_file=tokens_file,
+                        retries=retries, retry_delay=retry_delay, limiter=limiter, rate_limit=rate_limit,
+                        rate_burst=rate_burst, validate_baseurl=validate_baseurl, debug=debug)
+        self.tesla_client = tesla_client
+        self.pool = pool or AsyncConnectionPool(maxsize=pool_size, idle_timeout=pool_idle_timeout)
+        self.vehicles = []
+        self._refresh_lock = None
+
+
+
+    @classmethod
+    async def create(cls, **kwargs):
+        """Construct and connect an AsyncConnection"""
+        connection = cls(**kwargs)
+        await connection.connect()
+        return connection
+
+
+
+    async def connect(self):
+        """Obtain the API client description and the list of AsyncVehicle objects"""
+
+        # Obtain URL and program access tokens from pastebin if not on CLI
+        tesla_client = self.tesla_client
+        if not tesla_client:
+            tesla_client = await self._open("/raw/0a8e0xTJ", baseurl="http://pastebin.com")
+
+        self._set_client(tesla_client)
+
+        result = await self.get('vehicles')
+        self.vehicles = [AsyncVehicle(v, self) for v in sorted(result['response'], key=lambda d: d['id'])]
+        return self.vehicles
+
+
+
+    async def get(self, command):
+        """Utility command to get data from API"""
+        return await self.post(command, None)
+
+
+
+    async def post(self, command, data={}):
+        """Utility command to post data to API"""
+        if self._token_expired():
+            # Only one coroutine refreshes, the others wait for its result
+            if self._refresh_lock is None:
+                self._refresh_lock = asyncio.Lock()
+            async with self._refresh_lock:
+                if self._token_expired():
+                    await self._refresh_token()
+        return await self._open("%s%s" % (self.api, command), headers=self.head, data=data)
+
+
+
+    async def _refresh_token(self):
+        """Refresh tokens using either (preset) email/password or refresh_token"""
+
+        oauth = self._refresh_request()
+        self._refresh_response(await self._open("/oauth/token", data=oauth))
+
+
+
+    async def _open(self, url, headers={}, data=None, baseurl=""):
+        """Raw request command"""
+
+        if not baseurl:
+            baseurl = self.baseurl
+        headers, body = self._encode(headers, data)
+
+        for count in range(self.tries):
+            try:
+                wait = self.limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._count_call(url)
+
+                status, info, payload = await self.pool.request("POST" if body is not None else "GET",
+                                                                "%s%s" % (baseurl, url), headers=headers, body=body)
+                break
+            except (HTTPError, URLError) as e:
+                await asyncio.sleep(self._retry_wait(count, e))
+
+        self._count(payload)
+        return json.loads(payload.decode('utf-8'))
+
+
+
+
+class AsyncVehicle(dict):
+    """Vehicle class for AsyncConnection, subclassed from dictionary.
+
+    Same methods as teslajson.Vehicle, but each one is a coroutine.
+    """
+
+
+    def __init__(self, data, connection):
+        """Initialize vehicle class
+
+        Called automatically by the AsyncConnection class
+        """
+        super(AsyncVehicle, self).__init__(data)
+        self.connection = connection
+
+
+
+    async def data_all(self):
+        """Get all vehicle data"""
+        result = await self.get('data')
+        return result['response']
+
+
+
+    async def data_request(self, name):
+        """Get vehicle data"""
+        if name:
+            result = await self.get('data_request/%s' % name)
+        else:
+            result = await self.get(name)
+        return result['response']
+
+
+
+    async def wake_up(self):
+        """Wake the vehicle"""
+        return await self.post('wake_up')
+
+
+
+    async def command(self, name, data={}):
+        """Run the command for the vehicle"""
+        return await self.post('command/%s' % name, data)
+
+
+
+    async def get(self, command):
+        """Utility command to get data from API"""
+        if command:
+            return await self.connection.get('vehicles/%i/%s' % (self['id'], command))
+        else:
+            return await self.connection.get('vehicles/%i' % (self['id']))
+
+
+
+    async def post(self, command, data={}):
+        """Utility command to post data to API"""
+        return await self.connection.post('vehicles/%i/%s' % (self['id'], command), data)
@@ -0,0 +1,66 @@
+""" Tests of teslajson which need no network (python -m pytest, or python -m unittest) """
+
+import unittest
+
+import teslajson
+
+
+
+class rate_limiter_test(unittest.TestCase):
+
+    def test_sustained_rate(self):
+        """After the burst, requests are spaced 1/rate apart"""
+
+        limiter = teslajson.RateLimiter(rate=2, burst=2)
+        waits = [limiter.reserve() for i in range(5)]
+        self.assertEqual(waits[:2], [0, 0])
+        for before, after in zip(waits[2:], waits[3:]):
+            self.assertAlmostEqual(after - before, 0.5, places=2)
+
+
+
+    def test_spaced_after_defer(self):
+        """Requests queued during a Retry-After hold go 1/rate apart from its end, not all at once"""
+
+        limiter = teslajson.RateLimiter(rate=1, burst=5)
+        for i in range(5):
+            limiter.reserve()
+        limiter.defer(30)
+        waits = [limiter.reserve() for i in range(10)]
+        self.assertAlmostEqual(waits[0], 30, places=1)
+        for before, after in zip(waits, waits[1:]):
+            self.assertAlmostEqual(after - before, 1, places=2)
+
+
+
+    def test_defer_keeps_queue(self):
+        """Requests already queued past the end of a hold keep their place"""
+
+        limiter = teslajson.RateLimiter(rate=1, burst=1)
+        last = [limiter.reserve() for i in range(40)][-1]
+        limiter.defer(30)
+        self.assertAlmostEqual(limiter.reserve() - last, 1, places=1)
+
+
+
+class not_answered_test(unittest.TestCase):
+
+    def test_closed_without_reply(self):
+        """A connection closed before the status line may be retried, on Python 2 and 3"""
+
+        self.assertTrue(teslajson._not_answered(teslajson.BadStatusLine("")))
+        self.assertTrue(teslajson._not_answered(teslajson.BadStatusLine("''")))
+        self.assertTrue(teslajson._not_answered(teslajson.BadStatusLine("No status line received - the server has closed the connection")))
+
+
+
+    def test_other_errors(self):
+        """A garbled status line, or any other error, is not retried"""
+
+        self.assertFalse(teslajson._not_answered(teslajson.BadStatusLine("garbage")))
+        self.assertFalse(teslajson._not_answered(ValueError("")))
+
+
+
+if __name__ == "__main__":
+    unittest.main()